@@ -1,14 +1,23 @@
 import chess.pgn
 import chess.engine
+import eval_cache
+from engine_pool import EngineSession
+import known_positions
+import profiling
 
 class ChessAnalyzer:
-    def __init__(self, engine_path, pgn_file, new_pgn_file, t=None, n=None, d=None):
-        self.engine = chess.engine.SimpleEngine.popen_uci(engine_path)
+    def __init__(self, engine_path, pgn_file, new_pgn_file, t=None, n=None, d=None, cache=None, known=None, engine=None, wdl_model=None):
+        # An engine session passed in is shared with other analyzers and stays running after close()
+        self.owns_engine = engine is None
+        self.engine = EngineSession(engine_path) if engine is None else engine
         self.pgn_file = pgn_file
         self.new_pgn_file = new_pgn_file
         self.t = t
         self.n = n
         self.d = d
+        self.cache = cache
+        self.known = known
+        self.wdl_model = wdl_model
         self.w_gpl = 0
         self.b_gpl = 0
         self.w_moves = 0
@@ -18,32 +27,44 @@ class ChessAnalyzer:
         self.w_movesa = 0
         self.b_movesa = 0
 
+    def analyse_mainline(self, game):
+        # Search each position of the mainline once, skipping book and tablebase positions, and keep its WDL
+        board = game.board()
+        limit = chess.engine.Limit(time=self.t, nodes=self.n, depth=self.d)
+        wdls = [known_positions.analyse_wdl(self.engine, board, limit, self.cache, self.known, self.wdl_model)]
+        for move in game.mainline_moves():
+            board.push(move)
+            wdls.append(known_positions.analyse_wdl(self.engine, board, limit, self.cache, self.known, self.wdl_model))
+        return wdls
+
     def update_gpl(self, pgn):
         while True:
-            game = chess.pgn.read_game(pgn)
+            with profiling.stage('parse'):
+                game = chess.pgn.read_game(pgn)
             if game is None:
                 break
 
-            board = game.board()
-            for move in game.mainline_moves():
-                premove_info = self.engine.analyse(board, chess.engine.Limit(time=self.t, nodes=self.n, depth=self.d))
-                
-                if board.turn == chess.WHITE:
-                    premove_exp_w = premove_info['score'].white().wdl().expectation()
-                else:
-                    premove_exp_b = premove_info['score'].black().wdl().expectation()
-                board.push(move)
-                postmove_info = self.engine.analyse(board, chess.engine.Limit(time=self.t, nodes=self.n, depth=self.d))
-                postmove_wexp = postmove_info['score'].white().wdl().expectation()
-                postmove_bexp = postmove_info['score'].black().wdl().expectation()
+            # Games without moves have nothing to analyse
+            if game.next() is None:
+                continue
+            self.engine.start_game(game.headers)
+            wdls = self.analyse_mainline(game)
+            profiling.count('games')
+            profiling.count('plies', len(wdls) - 1)
+            # The post-move WDL of one ply is the pre-move WDL of the next
+            for premove_wdl, postmove_wdl in zip(wdls, wdls[1:]):
+                postmove_wexp = postmove_wdl.white().expectation()
+                postmove_bexp = postmove_wdl.black().expectation()
 
-                if board.turn == chess.BLACK:
+                if premove_wdl.turn == chess.WHITE:
+                    premove_exp_w = premove_wdl.white().expectation()
                     self.w_gpl += premove_exp_w - postmove_wexp
                     self.w_moves += 1
                     if premove_exp_w != 0:
                         self.w_ga += postmove_wexp / premove_exp_w
                         self.w_movesa += 1
                 else:
+                    premove_exp_b = premove_wdl.black().expectation()
                     self.b_gpl += premove_exp_b - postmove_bexp
                     self.b_moves += 1
                     if premove_exp_b != 0:
@@ -51,6 +72,10 @@ class ChessAnalyzer:
                         self.b_movesa += 1
 
     def save_results(self):
+        with profiling.stage('write'):
+            self._save_results()
+
+    def _save_results(self):
         with open(self.pgn_file) as f:
             game = chess.pgn.read_game(f)
         result = game.headers['Result']
@@ -91,17 +116,33 @@ class ChessAnalyzer:
         self.save_results()
 
     def close(self):
-        self.engine.quit()
+        if self.owns_engine:
+            self.engine.quit()
+
+def main(new_files=('PGN_file_goes_here',), engine_path='engine_path_goes_here',
+         # Engine limits t for time, d for depth and n for nodes
+         t=None, d=None, n=None,
+         cache_file='eval_cache.sqlite',
+         # Optional Syzygy tablebase directory and opening table of known scores
+         syzygy_path=None, opening_table=None,
+         # WDL model: a name from wdl_models.MODELS such as 'sf' or 'lichess', or the .json file of a calibrated model
+         wdl_model='sf',
+         # Time parsing, engine searches and writing and print a summary at the end (see profiling.py)
+         profile=False, trace_file=None):
+    if profile:
+        profiling.enable(trace=trace_file is not None)
+    # One warmed-up engine session serves every file
+    engine = EngineSession(engine_path)
+    with eval_cache.EvalCache(cache_file) as cache, known_positions.KnownPositions(syzygy_path, opening_table, wdl_model=wdl_model) as known:
+        for new_file in new_files:
+            analyzer = ChessAnalyzer(engine_path, new_file + '.pgn', new_file + '_gi.pgn', t=t, n=n, d=d, cache=cache, known=known, engine=engine, wdl_model=wdl_model)
+            analyzer.run()
+            analyzer.close()
+        engine.quit()
+        print(cache.report())
+        print(known.report())
+        profiling.note('cache hit rate', f"{cache.hit_rate():.1%}")
+        profiling.report(trace_file)
 
 if __name__ == "__main__":
-    t = set_time
-    d = set_depth
-    n = set_nodes
-    new_file = 'PGN_file_goes_here'
-    pgn_file = new_file + '.pgn'
-    new_pgn_file = new_file + '_gi.pgn'
-    engine_path = 'engine_path_goes_here'
-
-    analyzer = ChessAnalyzer(engine_path, pgn_file, new_pgn_file, t=t, n=n, d=d)
-    analyzer.run()
-    analyzer.close()
+    main()
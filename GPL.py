@@ -1,6 +1,7 @@
 import chess.pgn
 import chess.engine
 from chess.engine import Cp, Mate, MateGiven
+import wdl_models
 
 
 # Load the PGN file
@@ -9,6 +10,9 @@ pgn = open('carlsen-wang.pgn')
 # Initialize the engine
 engine = chess.engine.SimpleEngine.popen_uci('/home/linuxbrew/.linuxbrew/Cellar/stockfish/15.1/bin/stockfish')
 
+# WDL model: a name from wdl_models.MODELS such as 'sf' or 'lichess', or the .json file of a calibrated model
+model = wdl_models.get_model('sf')
+
 # Set engine limits d for depth, t for time, and n for nodes
 d = 20
 t = 1
@@ -30,24 +34,25 @@ while True:
     if game is None:
         break
 
-    # Play through the game using the engine
+    # Play through the game using the engine, searching each position once
     board = game.board()
+    b_info = engine.analyse(board, chess.engine.Limit(time=t))
     for move in game.mainline_moves():
-        # Info before the move
-        b_info = engine.analyse(board, chess.engine.Limit(time=t))
+        # Info before the move is the info after the previous move
         if board.turn == chess.WHITE:
-            b_exp = b_info['score'].white().wdl().expectation()
+            b_exp = model.pov_wdl(b_info['score']).white().expectation()
         else:
-            b_exp = b_info['score'].black().wdl().expectation()
+            b_exp = model.pov_wdl(b_info['score']).black().expectation()
         board.push(move)
         # Update the GPL and move counters: Info after the move
         a_info = engine.analyse(board, chess.engine.Limit(time=t))
         if board.turn == chess.BLACK:
-            w_gpl += b_exp-a_info['score'].white().wdl().expectation()
+            w_gpl += b_exp-model.pov_wdl(a_info['score']).white().expectation()
             w_moves += 1
         else:
-            b_gpl += b_exp-a_info['score'].black().wdl().expectation()
+            b_gpl += b_exp-model.pov_wdl(a_info['score']).black().expectation()
             b_moves += 1
+        b_info = a_info
             
 # Calculate the average centipawn loss for each player
 w_agpl = w_gpl / w_moves
@@ -0,0 +1,166 @@
+"""asyncio analysis backend that keeps every engine busy.
+
+Several UCI engines are driven from one event loop running in a background
+thread. All positions of a game are queued at once, positions from several
+games are in flight together, and each engine picks up the next position as
+soon as it finishes the previous one. The main thread keeps parsing PGN and
+writing results meanwhile, because submit() returns an ordinary
+concurrent.futures.Future like engine_pool.EnginePool.submit(). Engines are
+warmed up once and restarted if they crash, and the position that was in
+flight is searched again. As with engine_pool, hash_scope decides whether an
+engine clears its hash between games, between events or never."""
+
+# Import the necessary libraries
+import asyncio
+import itertools
+import threading
+import chess
+import chess.engine
+import profiling
+import wdl_models
+
+
+class AsyncEnginePool:
+    def __init__(self, engine_path, workers=1, options=None, warm_up=True, max_restarts=3, hash_scope='event'):
+        # hash_scope is 'game', 'event' or 'batch' as in engine_pool.EngineSession
+        if hash_scope not in ('game', 'event', 'batch'):
+            raise ValueError(f"Unknown hash scope {hash_scope!r}")
+        # options is either one dict applied to every engine or one dict per engine
+        if options is None or isinstance(options, dict):
+            options = [options or {}] * workers
+        if len(options) != workers:
+            raise ValueError(f"Expected {workers} option sets, got {len(options)}")
+        self.engine_path = engine_path
+        self.workers = workers
+        self.options = options
+        self.warm_up = warm_up
+        self.max_restarts = max_restarts
+        self.hash_scope = hash_scope
+        self.games = itertools.count()
+        self.restarted = 0
+        self.engines = []
+        # Run the event loop in its own thread so that callers stay synchronous
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+        try:
+            asyncio.run_coroutine_threadsafe(self._start(options), self.loop).result()
+        except Exception:
+            self.close()
+            raise
+        self.engine_name = self.engines[0].id.get('name', 'unknown')
+
+    async def _start(self, options):
+        self.idle = asyncio.Queue()
+        for number, engine_options in enumerate(options):
+            self.engines.append(await self._open(engine_options))
+            self.idle.put_nowait(number)
+
+    async def _open(self, engine_options):
+        for attempt in range(self.max_restarts + 1):
+            try:
+                transport, engine = await chess.engine.popen_uci(self.engine_path)
+                # Options such as Threads and Hash are sent once per process
+                if engine_options:
+                    await engine.configure(engine_options)
+                # A first short search loads the network and allocates the hash before the timed searches start
+                if self.warm_up:
+                    await engine.analyse(chess.Board(), chess.engine.Limit(depth=1))
+                return engine
+            except chess.engine.EngineTerminatedError:
+                if attempt == self.max_restarts:
+                    raise
+
+    # Get the key that decides when the engines clear their hash: an engine gets ucinewgame whenever the key of
+    # the position it searches differs from that of its previous search
+    def game_key(self, headers):
+        if self.hash_scope == 'game':
+            return next(self.games)
+        if self.hash_scope == 'event':
+            return (headers.get('Event'), headers.get('Site'))
+        return None
+
+    # Search one position on the next free engine, replacing the engine if it crashed and searching the position again
+    async def analyse(self, board, limit, game=None):
+        number = await self.idle.get()
+        try:
+            for attempt in range(self.max_restarts + 1):
+                try:
+                    if self.engines[number] is None:
+                        self.restarted += 1
+                        self.engines[number] = await self._open(self.options[number])
+                    # The stage is timed on the event loop thread, so its CPU time is not that of the search
+                    with profiling.stage('engine'):
+                        return await self.engines[number].analyse(board, limit, game=game)
+                except chess.engine.EngineTerminatedError:
+                    # An engine that keeps dying on the same position is given up on
+                    if attempt == self.max_restarts:
+                        raise
+                    self.engines[number] = None
+        finally:
+            self.idle.put_nowait(number)
+
+    # Search every position of a game's mainline concurrently and return their WDL in order
+    async def analyse_mainline(self, game, limit, cache=None, checkpoint=None, game_key=None, known=None, wdl_model=None):
+        model = wdl_models.get_model(wdl_model)
+        board = game.board()
+        boards = [board.copy()]
+        for move in game.mainline_moves():
+            board.push(move)
+            boards.append(board.copy())
+        if len(boards) == 1:
+            return []
+        hash_key = self.game_key(game.headers)
+
+        async def evaluate(ply, position):
+            # Positions logged by an interrupted run or already in the cache are not searched again
+            win_draw_loss = checkpoint.get(game_key, ply, position.turn) if checkpoint else None
+            if win_draw_loss is not None:
+                return win_draw_loss
+            # Book and tablebase positions are not searched
+            win_draw_loss = known.lookup(position) if known else None
+            if win_draw_loss is None:
+                # Cache lookups and writes and the fsync of a checkpoint record block, so they run in worker threads
+                # and the event loop keeps feeding the engines meanwhile
+                info = await asyncio.to_thread(cache.get, position, self.engine_name, limit) if cache else None
+                if info is None:
+                    info = await self.analyse(position, limit, hash_key)
+                    if cache:
+                        await asyncio.to_thread(cache.put, position, self.engine_name, limit, info)
+                win_draw_loss = model.pov_wdl(info['score'])
+            if checkpoint:
+                await asyncio.to_thread(checkpoint.record, game_key, ply, win_draw_loss)
+            return win_draw_loss
+
+        return list(await asyncio.gather(*(evaluate(ply, position) for ply, position in enumerate(boards))))
+
+    # Number of times an engine of the pool crashed and was restarted
+    def restarts(self):
+        return self.restarted
+
+    # Schedule coroutine_function(pool, *args) on the event loop and return a concurrent.futures.Future
+    def submit(self, coroutine_function, *args):
+        return asyncio.run_coroutine_threadsafe(coroutine_function(self, *args), self.loop)
+
+    async def _quit(self):
+        for engine in self.engines:
+            if engine is None:
+                continue
+            try:
+                await engine.quit()
+            except chess.engine.EngineTerminatedError:
+                pass
+        self.engines = []
+
+    def close(self):
+        if self.loop.is_running():
+            asyncio.run_coroutine_threadsafe(self._quit(), self.loop).result()
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join()
+        self.loop.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
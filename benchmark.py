@@ -0,0 +1,262 @@
+"""Reproducible throughput benchmark of the GI/GPL scripts.
+
+Every code path is run on the sample PGN files bundled in benchmarks/:
+short and long games with %eval comments and games without them. The
+engine-driven paths run against mock_engine.py, a deterministic stand-in UCI
+engine. Each case runs in a fresh process so that its peak RSS is its own.
+The results (plies/sec, games/sec, peak RSS and engine calls per ply) are
+written as JSON so that speedups and regressions can be tracked over time.
+
+Usage: python benchmark.py [output.json]"""
+
+# Import the necessary libraries
+import datetime
+import importlib.machinery
+import importlib.util
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+import chess
+import chess.engine
+import chess.pgn
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+BENCHMARK_DIR = os.path.join(ROOT, 'benchmarks')
+EVAL_FILES = ['short_eval.pgn', 'long_eval.pgn']
+ENGINE_FILES = ['no_eval.pgn']
+SAMPLE_FILES = EVAL_FILES + ENGINE_FILES
+MOCK_ENGINE = [sys.executable, os.path.join(ROOT, 'mock_engine.py')]
+# The engine paths are timed on the first games of ENGINE_FILES only
+ENGINE_GAMES = 25
+SCORING_SYSTEM = 'NorwayChess'
+
+
+# Function to get the path of a bundled sample file
+def sample_path(name):
+    return os.path.join(BENCHMARK_DIR, name)
+
+
+# Function to read every game of a PGN file
+def read_games(path):
+    games = []
+    with open(path) as pgn:
+        while True:
+            game = chess.pgn.read_game(pgn)
+            if game is None:
+                return games
+            games.append(game)
+
+
+# Function to count the plies of a list of games
+def count_plies(games):
+    return sum(game.end().ply() - game.ply() for game in games)
+
+
+# Function to get the peak resident set size of this process in megabytes
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return peak / 2**20 if sys.platform == 'darwin' else peak / 2**10
+
+
+# Function to import a script that has no .py extension, such as tournamentGI
+def load_script(name):
+    loader = importlib.machinery.SourceFileLoader(name, os.path.join(ROOT, name))
+    module = importlib.util.module_from_spec(importlib.util.spec_from_loader(name, loader))
+    loader.exec_module(module)
+    return module
+
+
+# Eval-only scoring of pre-parsed games, one calculate_gi call per game
+def bench_eval_only_calculate_gi(workdir):
+    import calculate_GI_WO_engine
+    games = [game for name in EVAL_FILES for game in read_games(sample_path(name))]
+    start = time.perf_counter()
+    for game in games:
+        calculate_GI_WO_engine.calculate_gi(0, game, 0, 0, None, None, 0, 0, SCORING_SYSTEM, calculate_GI_WO_engine.zero_counts())
+    return time.perf_counter() - start, len(games), count_plies(games), None
+
+
+# Eval-only scoring straight from the files, parsing included
+def bench_eval_only_stream(workdir):
+    import calculate_GI_WO_engine
+    games = plies = 0
+    start = time.perf_counter()
+    for name in EVAL_FILES:
+        with open(sample_path(name)) as pgn:
+            for headers, game_result in calculate_GI_WO_engine.score_games_in_stream(pgn, SCORING_SYSTEM):
+                games += 1
+                plies += game_result[4] + game_result[5]
+    return time.perf_counter() - start, games, plies, None
+
+
+# Splitting multi-game files into one file per game
+def bench_split_pgns(workdir):
+    import from_PGN_to_PGNs
+    games = [game for name in SAMPLE_FILES for game in read_games(sample_path(name))]
+    start = time.perf_counter()
+    for name in SAMPLE_FILES:
+        from_PGN_to_PGNs.split_pgn_file(sample_path(name), os.path.join(workdir, name[:-4]))
+    return time.perf_counter() - start, len(games), count_plies(games), None
+
+
+# Scanning eval-annotated files for %eval coverage
+def bench_check_evals(workdir):
+    import check_evals
+    games = [game for name in EVAL_FILES for game in read_games(sample_path(name))]
+    for name in EVAL_FILES:
+        shutil.copy(sample_path(name), workdir)
+    start = time.perf_counter()
+    check_evals.scan_coverage(workdir)
+    return time.perf_counter() - start, len(games), count_plies(games), None
+
+
+# Tournament aggregation over one scored PGN file per game
+def bench_tournament_gi(workdir):
+    import calculate_GI_WO_engine
+    tournament_gi = load_script('tournamentGI')
+    games = [game for name in EVAL_FILES for game in read_games(sample_path(name))]
+    # Write the games the way the scoring scripts leave them, with GI and GPL headers
+    for number, game in enumerate(games):
+        white_gi, black_gi, white_gpl, black_gpl = calculate_GI_WO_engine.calculate_gi(
+            0, game, 0, 0, None, None, 0, 0, SCORING_SYSTEM, calculate_GI_WO_engine.zero_counts())[:4]
+        game.headers['WhiteGI'] = f"{white_gi:.2f}"
+        game.headers['BlackGI'] = f"{black_gi:.2f}"
+        game.headers['WhiteGPL'] = f"{white_gpl:.2f}"
+        game.headers['BlackGPL'] = f"{black_gpl:.2f}"
+        with open(os.path.join(workdir, f'game{number}.pgn'), 'w') as pgn:
+            print(game, file=pgn)
+    start = time.perf_counter()
+    player_stats_gi, player_stats_gpl = tournament_gi.get_player_stats(workdir)
+    tournament_gi.write_player_stats(os.path.join(workdir, 'tournamentGI.csv'), tournament_gi.player_stat_rows(player_stats_gi, player_stats_gpl))
+    return time.perf_counter() - start, len(games), count_plies(games), None
+
+
+# Function to write the games timed on the engine paths to one file and return them
+def engine_games(workdir):
+    games = [game for name in ENGINE_FILES for game in read_games(sample_path(name))][:ENGINE_GAMES]
+    with open(os.path.join(workdir, 'engine_games.pgn'), 'w') as pgn:
+        for game in games:
+            print(game, file=pgn, end='\n\n')
+    return games
+
+
+# Engine analysis through calculate_GI on a pool with one engine
+def bench_engine_calculate_gi(workdir):
+    import calculate_GI
+    from engine_pool import EnginePool
+    games = engine_games(workdir)
+    with EnginePool(MOCK_ENGINE, 1) as pool:
+        start = time.perf_counter()
+        for future in [pool.submit(calculate_GI.score_game, game, None, 1, SCORING_SYSTEM) for game in games]:
+            future.result()
+        seconds = time.perf_counter() - start
+        engine_calls = pool.searches()
+    return seconds, len(games), count_plies(games), engine_calls
+
+
+# Engine analysis through GI.ChessAnalyzer
+def bench_engine_gi_analyzer(workdir):
+    import GI
+    from engine_pool import EngineSession
+    games = engine_games(workdir)
+    pgn_file = os.path.join(workdir, 'engine_games.pgn')
+    engine = EngineSession(MOCK_ENGINE)
+    try:
+        start = time.perf_counter()
+        analyzer = GI.ChessAnalyzer(None, pgn_file, None, n=1, engine=engine)
+        with open(pgn_file) as pgn:
+            analyzer.update_gpl(pgn)
+        seconds = time.perf_counter() - start
+    finally:
+        engine.quit()
+    return seconds, len(games), count_plies(games), engine.searches
+
+
+CASES = {
+    'eval_only_calculate_gi': bench_eval_only_calculate_gi,
+    'eval_only_stream': bench_eval_only_stream,
+    'split_pgns': bench_split_pgns,
+    'check_evals': bench_check_evals,
+    'tournament_gi': bench_tournament_gi,
+    'engine_calculate_gi': bench_engine_calculate_gi,
+    'engine_gi_analyzer': bench_engine_gi_analyzer,
+}
+
+
+# Function to run one case in a scratch directory and measure it
+def run_case(name):
+    sys.path.insert(0, ROOT)
+    workdir = tempfile.mkdtemp(prefix='benchmark-')
+    try:
+        seconds, games, plies, engine_calls = CASES[name](workdir)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return {
+        'seconds': seconds,
+        'games': games,
+        'plies': plies,
+        'engine_calls': engine_calls,
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+# Function to describe the machine and the code that was measured
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'processor': platform.processor() or platform.machine(),
+        'python_chess': chess.__version__,
+        'numpy': importlib.util.find_spec('numpy') is not None,
+        'pyarrow': importlib.util.find_spec('pyarrow') is not None,
+    }
+
+
+# Main function
+def main():
+    output_file = sys.argv[1] if len(sys.argv) > 1 else 'benchmark.json'
+    # Each case is run this many times and the fastest run is kept
+    repeats = 3
+
+    results = {}
+    for name in CASES:
+        runs = []
+        for repeat in range(repeats):
+            # A fresh process per run, so that the peak RSS and the imports belong to this case alone
+            with ProcessPoolExecutor(max_workers=1) as executor:
+                runs.append(executor.submit(run_case, name).result())
+        best = min(runs, key=lambda run: run['seconds'])
+        results[name] = {
+            'seconds': round(best['seconds'], 4),
+            'games': best['games'],
+            'plies': best['plies'],
+            'games_per_sec': round(best['games'] / best['seconds'], 1),
+            'plies_per_sec': round(best['plies'] / best['seconds'], 1),
+            'peak_rss_mb': round(max(run['peak_rss_mb'] for run in runs), 1),
+            'engine_calls_per_ply': round(best['engine_calls'] / best['plies'], 3) if best['engine_calls'] is not None else None,
+        }
+        print(f"{name:24} {results[name]['plies_per_sec']:>10.1f} plies/s {results[name]['games_per_sec']:>8.1f} games/s "
+              f"{results[name]['peak_rss_mb']:>7.1f} MB")
+
+    with open(output_file, 'w') as json_output_file:
+        json.dump({'environment': environment(), 'repeats': repeats, 'cases': results}, json_output_file, indent=4)
+    print(f"Results written to {output_file}")
+
+
+# Call the main function
+if __name__ == "__main__":
+    main()
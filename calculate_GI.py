@@ -2,33 +2,25 @@
  for each game in a PGN file and dump the data to a .json file."""
 
 # Import the necessary libraries
+import collections
+import concurrent.futures
+import functools
+import io
 import json
 import os
+import threading
+import time
 import chess.pgn
 import chess.engine
-
-# Function to load the JSON file
-def load_json_file(json_file):
-    default_data = {
-        "white_gi": 0,
-        "black_gi": 0,
-        "white_gpl": 0,
-        "black_gpl": 0,
-        "white_move_number": 0,
-        "black_move_number": 0,
-    }
-    try:
-        # Read the JSON file
-        with open(json_file) as json_input_file:
-            data = json.load(json_input_file)
-        # Ensure that all keys exist in the data dictionary
-        for key in default_data.keys():
-            if key not in data:
-                data[key] = default_data[key]
-        return data
-    except FileNotFoundError:
-        # Return default values if the file is not found
-        return default_data
+from engine_pool import EnginePool
+from async_engine import AsyncEnginePool
+import eval_cache
+import known_positions
+from checkpoint import CheckpointLog
+import pgn_index
+import profiling
+import results_store
+import wdl_models
 
 # Function to calculate the expected value of a position based on the scoring system
 def calculate_expected_value(win_prob, draw_prob, loss_prob, turn, scoring_system):
@@ -56,84 +48,292 @@ def calculate_expected_value(win_prob, draw_prob, loss_prob, turn, scoring_syste
     return expected_value_white, expected_value_black
 
 
-# Function to calculate GI and GPL
-def calculate_gi(move_number, target_move_number, game, engine, t, n, white_gpl, black_gpl, white_gi, black_gi, white_move_number, black_move_number, scoring_system):
+# Function to analyse each position of the game's mainline once
+def analyse_mainline(game, engine, limit, start_ply=0, cache=None, checkpoint=None, game_key=None, known=None, wdl_model=None):
     # Create a chess board from the current game
     board = game.board()
+    moves = list(game.mainline_moves())
+    # Nothing to score if every move is skipped
+    if start_ply >= len(moves):
+        return []
+    # The position after ply k is the position before ply k+1, so each one is searched once
+    wdls = []
+    for ply in range(len(moves) + 1):
+        if ply >= start_ply:
+            # Positions logged by an interrupted run are not searched again
+            win_draw_loss = checkpoint.get(game_key, ply, board.turn) if checkpoint else None
+            if win_draw_loss is None:
+                # Book and tablebase positions are not searched
+                win_draw_loss = known_positions.analyse_wdl(engine, board, limit, cache, known, wdl_model)
+                if checkpoint:
+                    checkpoint.record(game_key, ply, win_draw_loss)
+            wdls.append(win_draw_loss)
+        if ply < len(moves):
+            board.push(moves[ply])
+    return wdls
+
+# Expected point loss from which a move counts as a blunder, mistake or inaccuracy
+ERROR_THRESHOLDS = (0.7, 0.4, 0.2)
+
+# Function to count a move as a blunder, mistake or inaccuracy from its expected point loss
+def count_error(counts, color, point_loss):
+    blunder, mistake, inaccuracy = ERROR_THRESHOLDS
+    if point_loss >= blunder:
+        counts[color + '_blunder'] += 1
+    elif point_loss >= mistake:
+        counts[color + '_mistake'] += 1
+    elif point_loss >= inaccuracy:
+        counts[color + '_inaccuracy'] += 1
+
+# Engine time spent by adaptive analysis, shared by the threads of an engine pool
+class AdaptiveStats:
+    def __init__(self):
+        self.positions = 0
+        self.shallow_searches = 0
+        self.full_searches = 0
+        self.shallow_seconds = 0.0
+        self.full_seconds = 0.0
+        self.lock = threading.Lock()
+
+    def add(self, positions=0, shallow_searches=0, full_searches=0, shallow_seconds=0.0, full_seconds=0.0):
+        with self.lock:
+            self.positions += positions
+            self.shallow_searches += shallow_searches
+            self.full_searches += full_searches
+            self.shallow_seconds += shallow_seconds
+            self.full_seconds += full_seconds
+
+    # Time a uniform full-budget run would have taken, estimated from the full searches that were run
+    def uniform_seconds(self):
+        return self.positions * self.full_seconds / self.full_searches if self.full_searches else 0.0
 
-    # Iterate through all the moves in the game
+    def report(self):
+        spent = self.shallow_seconds + self.full_seconds
+        uniform = self.uniform_seconds()
+        saved = 1 - spent / uniform if uniform else 0.0
+        return (f"Adaptive search: {self.full_searches} of {self.positions} positions searched at the full budget, "
+                f"{spent:.1f}s of engine time against about {uniform:.1f}s uniform ({saved:.1%} saved)")
+
+# Function to get the expected points of both players from a WDL
+def expected_values_of(win_draw_loss, scoring_system):
+    turn = "White" if win_draw_loss.turn == chess.WHITE else "Black"
+    return calculate_expected_value(win_draw_loss[0] /1000, win_draw_loss[1] /1000, win_draw_loss[2] /1000, turn, scoring_system)
+
+# Function to analyse a game's mainline cheaply and spend the full budget only where the move losses are uncertain
+def analyse_mainline_adaptive(game, engine, shallow_limit, full_limit, scoring_system, margin=0.05, cache=None, checkpoint=None, game_key=None, stats=None, known=None, wdl_model=None):
+    model = wdl_models.get_model(wdl_model)
+    board = game.board()
+    boards = [board.copy()]
     for move in game.mainline_moves():
-        # If the current move number is less than the target move number
-        if move_number < target_move_number:
-            # Make the move on the board
-            board.push(move)
-            # Increment the move number
-            move_number += 1
-            # Skip to the next iteration
+        board.push(move)
+        boards.append(board.copy())
+    if len(boards) == 1:
+        return []
+
+    def search(position, limit):
+        start = time.perf_counter()
+        info = eval_cache.analyse(engine, position, limit, cache)
+        return model.pov_wdl(info['score']), time.perf_counter() - start
+
+    # Positions logged by an interrupted run and known positions are final, every other one gets a shallow search first
+    wdls = []
+    logged = []
+    final = []
+    shallow_searches = 0
+    shallow_seconds = 0.0
+    for ply, position in enumerate(boards):
+        win_draw_loss = checkpoint.get(game_key, ply, position.turn) if checkpoint else None
+        logged.append(win_draw_loss is not None)
+        final.append(False)
+        # Book and tablebase positions are final without a search
+        if win_draw_loss is None and known:
+            win_draw_loss = known.lookup(position)
+        if win_draw_loss is None:
+            win_draw_loss, seconds = search(position, shallow_limit)
+            shallow_searches += 1
+            shallow_seconds += seconds
+        else:
+            final[ply] = True
+        wdls.append(win_draw_loss)
+
+    # The move into position ply is uncertain if its loss lies within the margin of an error threshold
+    def uncertain(ply):
+        mover = 0 if wdls[ply - 1].turn == chess.WHITE else 1
+        point_loss = expected_values_of(wdls[ply - 1], scoring_system)[mover] - expected_values_of(wdls[ply], scoring_system)[mover]
+        return any(abs(point_loss - threshold) <= margin for threshold in ERROR_THRESHOLDS)
+
+    pending = set()
+    for ply in range(1, len(wdls)):
+        if uncertain(ply):
+            pending.update((ply - 1, ply))
+
+    # Search the uncertain positions at the full budget; where the deeper eval disagrees, the neighbours are searched too
+    full_searches = 0
+    full_seconds = 0.0
+    while pending:
+        ply = pending.pop()
+        if final[ply]:
             continue
+        shallow_white = expected_values_of(wdls[ply], scoring_system)[0]
+        wdls[ply], seconds = search(boards[ply], full_limit)
+        final[ply] = True
+        full_searches += 1
+        full_seconds += seconds
+        neighbours = [neighbour for neighbour in (ply - 1, ply + 1) if 0 <= neighbour < len(wdls)]
+        if abs(expected_values_of(wdls[ply], scoring_system)[0] - shallow_white) > margin:
+            pending.update(neighbours)
         else:
-            # Analyze the current board position using the chess engine
-            premove_info = engine.analyse(board, chess.engine.Limit(time=t, nodes=n))
-            # Get the expectation for both players before making the move
-            win_draw_loss = premove_info['score'].wdl()
-            win_prob, draw_prob, loss_prob = win_draw_loss[0] /1000, win_draw_loss[1] /1000, win_draw_loss[2] /1000
-            turn = "White" if board.turn == chess.WHITE else "Black"
-            premove_exp_white, premove_exp_black = calculate_expected_value(win_prob, draw_prob, loss_prob, turn, scoring_system)  
-            # Make the move on the board
-            board.push(move)
-            # Analyze the new board position using the chess engine
-            postmove_info = engine.analyse(board, chess.engine.Limit(time=t, nodes=n))
-            # Get the expectation for both players after making the move
-            win_draw_loss = postmove_info['score'].wdl()
-            win_prob, draw_prob, loss_prob = win_draw_loss[0] /1000, win_draw_loss[1] /1000, win_draw_loss[2]/1000
-            turn = "White" if board.turn == chess.WHITE else "Black"
-            postmove_exp_white, postmove_exp_black = calculate_expected_value(win_prob, draw_prob, loss_prob, turn, scoring_system)
-            # If it's black's turn
-            if board.turn == chess.BLACK:
-                # Update white's GPL
-                white_gpl += premove_exp_white - postmove_exp_white
-                # Update white's move number
-                white_move_number += 1
+            # The moves into and out of this position may now be near a threshold
+            for move_ply in (ply, ply + 1):
+                if 1 <= move_ply < len(wdls) and uncertain(move_ply):
+                    pending.update((move_ply - 1, move_ply))
+
+    # Log the positions once they are settled so a resumed run does not refine them again
+    if checkpoint:
+        for ply, win_draw_loss in enumerate(wdls):
+            if not logged[ply]:
+                checkpoint.record(game_key, ply, win_draw_loss)
+    if stats is not None:
+        # Only positions that needed the engine would have had a full search in a uniform run
+        stats.add(shallow_searches, shallow_searches, full_searches, shallow_seconds, full_seconds)
+    return wdls
+
+# Function to search a position with multipv lines through the cache and return the score of the best line
+# and, if the played move starts one of the lines, the score of that line (None if it does not)
+def analyse_multipv(engine, board, move, limit, multipv, cache=None):
+    search = f"multipv={multipv}"
+    engine_name = eval_cache.engine_key(engine) if cache else None
+    best = cache.get(board, engine_name, limit, search) if cache else None
+    if best is not None:
+        # The lines of a search are stored before its best line, so a missing line means the move was not among them
+        played = cache.get(board, engine_name, limit, f"{search},move={move.uci()}")
+        return best['score'], played['score'] if played else None
+    infos = engine.analyse(board, limit, multipv=multipv)
+    if cache:
+        for info in infos:
+            if info.get('pv'):
+                cache.put(board, engine_name, limit, info, f"{search},move={info['pv'][0].uci()}")
+        cache.put(board, engine_name, limit, infos[0], search)
+    played = [info for info in infos if info.get('pv') and info['pv'][0] == move]
+    return infos[0]['score'], played[0]['score'] if played else None
+
+# Function to score every move of a game's mainline from one MultiPV search of the position before it
+def analyse_moves_multipv(game, engine, limit, multipv=3, cache=None, checkpoint=None, game_key=None, known=None, wdl_model=None):
+    model = wdl_models.get_model(wdl_model)
+    board = game.board()
+    move_wdls = []
+    # Checkpoint entries of this mode are kept apart from the per-position ones, two per ply
+    checkpoint_key = f"{game_key}/multipv{multipv}"
+    for ply, move in enumerate(game.mainline_moves()):
+        mover = board.turn
+        premove_wdl = checkpoint.get(checkpoint_key, 2 * ply, mover) if checkpoint else None
+        postmove_wdl = checkpoint.get(checkpoint_key, 2 * ply + 1, mover) if checkpoint else None
+        if premove_wdl is None or postmove_wdl is None:
+            board_after = board.copy(stack=False)
+            board_after.push(move)
+            # Book and tablebase positions on both sides of the move need no search
+            premove_wdl = known.lookup(board) if known else None
+            postmove_wdl = known.lookup(board_after) if premove_wdl is not None else None
+            if postmove_wdl is not None:
+                # Seen from the mover, like the lines of a search of the position before the move
+                postmove_wdl = chess.engine.PovWdl(postmove_wdl.pov(mover), mover)
             else:
-                # Update black's GPL
-                black_gpl += premove_exp_black - postmove_exp_black
-                # Update black's move number
-                black_move_number += 1
-            # Check if the game has a result
-            if 'Result' in game.headers and game.headers['Result'] != '*':
-                # Get the result of the game
-                result = game.headers['Result']
-                # If white won
-                if result == '1-0':
-                    # Calculate GI for both players
-                    if scoring_system == "NorwayChess":
-                        white_gi = 3 - white_gpl
-                    # If the scoring system is "FIDE"
-                    else:
-                        white_gi = 1 - white_gpl
-                    black_gi = -black_gpl
-                # If black won
-                elif result == '0-1':
-                    # Calculate GI for both players
-                    if scoring_system == "NorwayChess":
-                        black_gi = 3 - black_gpl
-                    # If the scoring system is "FIDE"
-                    else:
-                        black_gi = 1 - black_gpl
-                    white_gi = -white_gpl
+                # The best line and, if it is among the top lines, the played move come from the same search
+                best_score, played_score = analyse_multipv(engine, board, move, limit, multipv, cache)
+                premove_wdl = model.pov_wdl(best_score)
+                if played_score is not None:
+                    postmove_wdl = model.pov_wdl(played_score)
                 else:
-                    # If it's a draw, calculate GI for both players
-                    if scoring_system == "NorwayChess":
-                        white_gi = 1.25 - white_gpl
-                        black_gi = 1.25 - black_gpl
-                    # If the scoring system is "FIDE"
-                    else:
-                        white_gi = 0.5 - white_gpl
-                        black_gi = 0.5 - black_gpl
+                    postmove_wdl = model.pov_wdl(eval_cache.analyse(engine, board, limit, cache, root_moves=[move])['score'])
+                    # A separate search can rate the played move above the best line; then it is the best move
+                    if postmove_wdl.relative.expectation() > premove_wdl.relative.expectation():
+                        premove_wdl = postmove_wdl
+            if checkpoint:
+                checkpoint.record(checkpoint_key, 2 * ply, premove_wdl)
+                checkpoint.record(checkpoint_key, 2 * ply + 1, postmove_wdl)
+        move_wdls.append((premove_wdl, postmove_wdl))
+        board.push(move)
+    return move_wdls
+
+# Function to calculate GI and GPL
+def calculate_gi(game, engine, t, n, white_gpl, black_gpl, white_gi, black_gi, white_move_number, black_move_number, scoring_system, cache=None, checkpoint=None, game_key=None, counts=None, known=None, wdl_model=None):
+    # Evaluate every position of the mainline
+    wdls = analyse_mainline(game, engine, chess.engine.Limit(time=t, nodes=n), 0, cache, checkpoint, game_key, known, wdl_model)
+    return calculate_gi_from_wdls(game, wdls, white_gpl, black_gpl, white_gi, black_gi, white_move_number, black_move_number, scoring_system, counts)
+
+# Function to calculate GI and GPL from the WDL of consecutive positions of a game
+def calculate_gi_from_wdls(game, wdls, white_gpl, black_gpl, white_gi, black_gi, white_move_number, black_move_number, scoring_system, counts=None):
+    # The position after one ply is the position before the next
+    move_wdls = list(zip(wdls, wdls[1:]))
+    with profiling.stage('wdl'):
+        return calculate_gi_from_move_wdls(game, move_wdls, white_gpl, black_gpl, white_gi, black_gi, white_move_number, black_move_number, scoring_system, counts)
+
+# Function to calculate GI and GPL from the WDL before and after each move of a game
+def calculate_gi_from_move_wdls(game, move_wdls, white_gpl, black_gpl, white_gi, black_gi, white_move_number, black_move_number, scoring_system, counts=None):
+    # Compute the loss of each move from the expectation of both players before and after it
+    for premove_wdl, postmove_wdl in move_wdls:
+        premove_exp_white, premove_exp_black = expected_values_of(premove_wdl, scoring_system)
+        postmove_exp_white, postmove_exp_black = expected_values_of(postmove_wdl, scoring_system)
+        # If it's white's move
+        if premove_wdl.turn == chess.WHITE:
+            # Update white's GPL
+            exp_white_point_loss = premove_exp_white - postmove_exp_white
+            white_gpl += exp_white_point_loss
+            # Add blunder, mistake, inaccuracy
+            if counts is not None:
+                count_error(counts, 'white', exp_white_point_loss)
+            # Update white's move number
+            white_move_number += 1
+        else:
+            # Update black's GPL
+            exp_black_point_loss = premove_exp_black - postmove_exp_black
+            black_gpl += exp_black_point_loss
+            # Add blunder, mistake, inaccuracy
+            if counts is not None:
+                count_error(counts, 'black', exp_black_point_loss)
+            # Update black's move number
+            black_move_number += 1
+
+    # Nothing was analysed, keep the previous GI
+    if not move_wdls:
+        return white_gi, black_gi, white_gpl, black_gpl, white_move_number, black_move_number
+
+    # Check if the game has a result
+    if 'Result' in game.headers and game.headers['Result'] != '*':
+        # Get the result of the game
+        result = game.headers['Result']
+        # If white won
+        if result == '1-0':
+            # Calculate GI for both players
+            if scoring_system == "NorwayChess":
+                white_gi = 3 - white_gpl
+            # If the scoring system is "FIDE"
             else:
-                # Calculate (expected) GI for both players
-                white_gi = postmove_exp_white - white_gpl
-                black_gi = postmove_exp_black - black_gpl
+                white_gi = 1 - white_gpl
+            black_gi = -black_gpl
+        # If black won
+        elif result == '0-1':
+            # Calculate GI for both players
+            if scoring_system == "NorwayChess":
+                black_gi = 3 - black_gpl
+            # If the scoring system is "FIDE"
+            else:
+                black_gi = 1 - black_gpl
+            white_gi = -white_gpl
+        else:
+            # If it's a draw, calculate GI for both players
+            if scoring_system == "NorwayChess":
+                white_gi = 1.25 - white_gpl
+                black_gi = 1.25 - black_gpl
+            # If the scoring system is "FIDE"
+            else:
+                white_gi = 0.5 - white_gpl
+                black_gi = 0.5 - black_gpl
+    else:
+        # Calculate (expected) GI for both players
+        postmove_exp_white, postmove_exp_black = expected_values_of(move_wdls[-1][1], scoring_system)
+        white_gi = postmove_exp_white - white_gpl
+        black_gi = postmove_exp_black - black_gpl
     return white_gi, black_gi, white_gpl, black_gpl, white_move_number, black_move_number
 
 # Function to save the PGN file
@@ -159,72 +359,283 @@ def update_json_file(json_file, white_gpl, black_gpl, white_move_number, black_m
     with open(json_file, "w") as json_output_file:
         json.dump(data, json_output_file, indent=4)
 
-# Main function
-def main():
-    folder = 'folder_path_goes_here'
-    engine_path = 'engine_path_goes_here'
-    # Set engine limits d for depth, t for time, and n for nodes
-    # d = 20
-    t = 2
-    n = None
-    scoring_system = 'NorwayChess' # 'NorwayChess' or 'FIDE'
+# Function to get zero blunder, mistake and inaccuracy counts
+def zero_counts():
+    return {
+        "white_blunder": 0,
+        "black_blunder": 0,
+        "white_mistake": 0,
+        "black_mistake": 0,
+        "white_inaccuracy": 0,
+        "black_inaccuracy": 0,
+    }
 
-    # Get all the .pgn files in the folder
-    pgn_files = [f for f in os.listdir(folder) if f.endswith('.pgn')]
+# Function to score a single game on one engine of the pool, starting from zero totals
+def score_game(engine, game, t, n, scoring_system, cache=None, checkpoint=None, game_key=None, known=None, wdl_model=None):
+    engine.start_game(game.headers)
+    counts = zero_counts()
+    game_result = calculate_gi(game, engine, t, n, 0, 0, 0, 0, 0, 0, scoring_system, cache, checkpoint, game_key, counts, known, wdl_model)
+    return game_result, counts
+
+# Function to score a single game with adaptive analysis on one engine of the pool, starting from zero totals
+def score_game_adaptive(engine, game, t, n, scoring_system, cache=None, checkpoint=None, game_key=None, known=None, shallow_nodes=20000, margin=0.05, stats=None, wdl_model=None):
+    engine.start_game(game.headers)
+    counts = zero_counts()
+    wdls = analyse_mainline_adaptive(game, engine, chess.engine.Limit(nodes=shallow_nodes), chess.engine.Limit(time=t, nodes=n), scoring_system, margin, cache, checkpoint, game_key, stats, known, wdl_model)
+    game_result = calculate_gi_from_wdls(game, wdls, 0, 0, 0, 0, 0, 0, scoring_system, counts)
+    return game_result, counts
 
-    # Iterate through each PGN file
-    for pgn_file in pgn_files:
-        # Remove the file extension and create JSON and new PGN file names
-        new_file = pgn_file[:-4]
-        json_file = os.path.join(folder, new_file + '.json')
-        new_pgn_file = new_file + '_gi.pgn'
-
-        # Open the PGN file
-        pgn = open(os.path.join(folder, pgn_file))
-        # Initialize the chess engine
-        engine = chess.engine.SimpleEngine.popen_uci(engine_path)
-
-        # Load data from the JSON file
-        data = load_json_file(json_file)
-        white_gi = data['white_gi']
-        black_gi = data['black_gi']
-        white_gpl = data['white_gpl']
-        black_gpl = data['black_gpl']
-        white_move_number = data['white_move_number']
-        black_move_number = data['black_move_number']
-
-        # Initialize variables
-        move_number = 0
-        target_move_number = white_move_number + black_move_number
-
-        # Iterate through each game in the PGN file
+# Function to score a single game from one MultiPV search per move on one engine of the pool, starting from zero totals
+def score_game_multipv(engine, game, t, n, scoring_system, cache=None, checkpoint=None, game_key=None, known=None, multipv=3, wdl_model=None):
+    engine.start_game(game.headers)
+    counts = zero_counts()
+    move_wdls = analyse_moves_multipv(game, engine, chess.engine.Limit(time=t, nodes=n), multipv, cache, checkpoint, game_key, known, wdl_model)
+    with profiling.stage('wdl'):
+        game_result = calculate_gi_from_move_wdls(game, move_wdls, 0, 0, 0, 0, 0, 0, scoring_system, counts)
+    return game_result, counts
+
+# Function to compare adaptive with uniform full-budget analysis on a file of reference games
+def compare_with_uniform(engine, pgn_path, t, n, scoring_system, shallow_nodes=20000, margin=0.05, wdl_model=None):
+    full_limit = chess.engine.Limit(time=t, nodes=n)
+    stats = AdaptiveStats()
+    uniform_seconds = 0.0
+    largest_change = 0.0
+    games = 0
+    # No cache, so that neither mode reuses the searches of the other
+    with open(pgn_path) as pgn:
         while True:
             game = chess.pgn.read_game(pgn)
             if game is None:
                 break
+            games += 1
+            # Both passes start from an empty hash, so the second one does not find the searches of the first
+            engine.start_game(game.headers, clear_hash=True)
+            adaptive_wdls = analyse_mainline_adaptive(game, engine, chess.engine.Limit(nodes=shallow_nodes), full_limit, scoring_system, margin, stats=stats, wdl_model=wdl_model)
+            engine.start_game(game.headers, clear_hash=True)
+            start = time.perf_counter()
+            uniform_wdls = analyse_mainline(game, engine, full_limit, wdl_model=wdl_model)
+            uniform_seconds += time.perf_counter() - start
+            adaptive_result = calculate_gi_from_wdls(game, adaptive_wdls, 0, 0, 0, 0, 0, 0, scoring_system)
+            uniform_result = calculate_gi_from_wdls(game, uniform_wdls, 0, 0, 0, 0, 0, 0, scoring_system)
+            # Indices 2 and 3 are the white and black GPL of the game
+            for side in (2, 3):
+                largest_change = max(largest_change, abs(adaptive_result[side] - uniform_result[side]))
+    spent = stats.shallow_seconds + stats.full_seconds
+    saved = 1 - spent / uniform_seconds if uniform_seconds else 0.0
+    return (f"Reference set: {games} games, {stats.full_searches} of {stats.positions} positions searched at the full budget, "
+            f"{spent:.1f}s adaptive against {uniform_seconds:.1f}s uniform ({saved:.1%} saved), "
+            f"largest change in a game's GPL {largest_change:.4f}")
+
+# Function to score a single game on an asyncio engine pool, starting from zero totals
+async def score_game_async(pool, game, t, n, scoring_system, cache=None, checkpoint=None, game_key=None, known=None, wdl_model=None):
+    counts = zero_counts()
+    # Every position of the game is queued at once and searched by whichever engine is free
+    wdls = await pool.analyse_mainline(game, chess.engine.Limit(time=t, nodes=n), cache, checkpoint, game_key, known, wdl_model)
+    game_result = calculate_gi_from_wdls(game, wdls, 0, 0, 0, 0, 0, 0, scoring_system, counts)
+    return game_result, counts
 
-            # Calculate GI and GPL for the current game
-            white_gi, black_gi, white_gpl, black_gpl, white_move_number, black_move_number = calculate_gi(
-                move_number, target_move_number, game, engine, t, n, white_gpl, black_gpl, white_gi, black_gi, white_move_number, black_move_number, scoring_system)
+# Function to merge the result of one game into the running totals of a file
+def merge_game_result(data, game_result):
+    white_gi, black_gi, white_gpl, black_gpl, white_move_number, black_move_number = game_result
+    data['white_gpl'] += white_gpl
+    data['black_gpl'] += black_gpl
+    data['white_move_number'] += white_move_number
+    data['black_move_number'] += black_move_number
+    # GI is the points of the latest analysed game minus the running GPL
+    if white_move_number + black_move_number > 0:
+        data['white_gi'] = white_gi + white_gpl - data['white_gpl']
+        data['black_gi'] = black_gi + black_gpl - data['black_gpl']
+    return data
 
-        # Read the game again
-        game = chess.pgn.read_game(open(os.path.join(folder, pgn_file)))
+# Function to write the totals of a file to its JSON file and, in the headers of its first game, to its _gi.pgn file
+def write_file_totals(folder, pgn_file, json_file, data, index):
+    # Seek straight to the first game again
+    game = pgn_index.read_game_at(os.path.join(folder, pgn_file), index, 0)
 
-        # Add GI data to the game headers if they exist
-        game.headers["WhiteGI"] = f"{white_gi:.2f}"
-        game.headers["BlackGI"] = f"{black_gi:.2f}"
+    # Add GI data to the game headers if they exist
+    game.headers["WhiteGI"] = f"{data['white_gi']:.2f}"
+    game.headers["BlackGI"] = f"{data['black_gi']:.2f}"
 
-        # Add GPL data to the game headers
-        game.headers["WhiteGPL"] = f"{white_gpl:.2f}"
-        game.headers["BlackGPL"] = f"{black_gpl:.2f}"
+    # Add GPL data to the game headers
+    game.headers["WhiteGPL"] = f"{data['white_gpl']:.2f}"
+    game.headers["BlackGPL"] = f"{data['black_gpl']:.2f}"
 
+    with profiling.stage('write'):
         # Save the game to the new PGN file
-        save_pgn_file(game, new_pgn_file)
+        save_pgn_file(game, pgn_file[:-4] + '_gi.pgn')
         # Update the JSON file with the new data
-        update_json_file(json_file, white_gpl, black_gpl, white_move_number, black_move_number, white_gi, black_gi)
+        update_json_file(json_file, data['white_gpl'], data['black_gpl'], data['white_move_number'], data['black_move_number'], data['white_gi'], data['black_gi'])
+
+# Main function
+def main(folder='folder_path_goes_here', engine_path='engine_path_goes_here',
+         # Engine limits t for time and n for nodes
+         t=2, n=None,
+         scoring_system='NorwayChess', # 'NorwayChess' or 'FIDE'
+         # Number of engine processes and the options sent to each of them (default {"Threads": 1, "Hash": 256})
+         workers=1, engine_options=None,
+         # When the engines may clear their hash: 'game', 'event' (keep it between games of the same event) or 'batch'
+         hash_scope='event',
+         # 'threads' gives each engine its own thread; 'asyncio' drives all engines from one event loop with every position of a game queued at once
+         backend='threads',
+         # Adaptive search: every position first gets a shallow_nodes search and only positions whose move loss is within
+         # adaptive_margin of an error threshold, or whose deeper eval disagrees with the shallow one, get the full t/n budget
+         adaptive=False, shallow_nodes=20000, adaptive_margin=0.05,
+         # MultiPV mode: with multipv = k > 0 each move is scored against the best line of one k-line search of the
+         # position before it, and only a played move outside the top k lines gets a second, root_moves-restricted search
+         multipv=0,
+         # Optional PGN file on which adaptive and uniform analysis are compared before the run
+         reference_file=None,
+         # Optional Syzygy tablebase directory and opening table (see known_positions.build_opening_table);
+         # positions found in either are never sent to the engine
+         syzygy_path=None, opening_table=None,
+         # Evaluation cache shared by every run (default eval_cache.sqlite in the folder), capped at max_cache_entries positions
+         cache_file=None, max_cache_entries=1000000,
+         # Per-game, per-player results (default results.parquet in the folder; Parquet with pyarrow, CSV otherwise)
+         results_file=None,
+         # WDL model: a name from wdl_models.MODELS such as 'sf' or 'lichess', or the .json file of a calibrated model
+         wdl_model='sf',
+         # Time PGN parsing, engine searches, WDL conversion and writing, print a summary at the end
+         # and optionally save a Chrome trace (see profiling.py)
+         profile=False, trace_file=None):
+    if engine_options is None:
+        engine_options = {"Threads": 1, "Hash": 256}
+    if cache_file is None:
+        cache_file = os.path.join(folder, 'eval_cache.sqlite')
+    if results_file is None:
+        results_file = os.path.join(folder, 'results.parquet')
+
+    if profile:
+        profiling.enable(trace=trace_file is not None)
+
+    # Get all the .pgn files in the folder
+    pgn_files = [f for f in os.listdir(folder) if f.endswith('.pgn')]
+    # Engines live for the whole batch and are only restarted if they crash
+    thread_pool = functools.partial(EnginePool, hash_scope=hash_scope)
+    pool_class, game_scorer = (functools.partial(AsyncEnginePool, hash_scope=hash_scope), score_game_async) if backend == 'asyncio' else (thread_pool, score_game)
+    model = wdl_models.get_model(wdl_model)
+    # Adaptive and MultiPV analysis run on the threads backend
+    adaptive_stats = AdaptiveStats()
+    if multipv:
+        # MultiPV mode takes the place of adaptive search
+        adaptive = False
+        pool_class = thread_pool
+        game_scorer = functools.partial(score_game_multipv, multipv=multipv)
+    elif adaptive:
+        pool_class = thread_pool
+        game_scorer = functools.partial(score_game_adaptive, shallow_nodes=shallow_nodes, margin=adaptive_margin, stats=adaptive_stats)
+    game_scorer = functools.partial(game_scorer, wdl_model=model)
+    # A checkpoint is only resumed by a run with the same engine, limit, mode and model
+    mode = f"multipv={multipv}" if multipv else f"adaptive,shallow_nodes={shallow_nodes},margin={adaptive_margin}" if adaptive else 'uniform'
+
+    # Start the engines once and reuse them for every file
+    with pool_class(engine_path, workers, engine_options) as pool, eval_cache.EvalCache(cache_file, max_cache_entries) as cache, \
+            results_store.ResultsWriter(results_file) as results, known_positions.KnownPositions(syzygy_path, opening_table, wdl_model=model) as known:
+        # Measure what adaptive analysis saves and how much it moves GPL before trusting it on the real files
+        if adaptive and reference_file:
+            print(pool.submit(compare_with_uniform, reference_file, t, n, scoring_system, shallow_nodes, adaptive_margin, model).result())
+
+        checkpoint_settings = {
+            'engine': eval_cache.engine_key(pool.engines[0]),
+            'limit': eval_cache.limit_key(chess.engine.Limit(time=t, nodes=n)),
+            'mode': mode,
+            'wdl_model': model.key(),
+        }
+        # Games whose content is unchanged since a run with the same settings and scoring system take their
+        # results from the store of that run instead of going to the engines again
+        results_settings = results_store.settings_key({**checkpoint_settings, 'scoring_system': scoring_system})
+        previous_results = results_store.load_game_results(results_file, results_settings)
+
+        # Games go through a bounded window of jobs that runs across files: no engine waits for the next file,
+        # yet only a few games per engine are parsed and held in memory at a time
+        window = workers * 4
+        pending = collections.deque()
+
+        # Merge the oldest job back in file and game order; a job without a future marks the end of its file
+        def collect_oldest():
+            file_job, game_number, headers, content_hash, future = pending.popleft()
+            if future is None:
+                write_file_totals(folder, file_job['pgn_file'], file_job['json_file'], file_job['data'], file_job['index'])
+                # The file is finished, so there is nothing left to resume
+                file_job['checkpoint'].remove()
+                return
+            game_result, counts = future.result()
+            file_job['data'] = merge_game_result(file_job['data'], game_result)
+            profiling.count('games')
+            profiling.count('plies', game_result[4] + game_result[5])
+            # Stream the per-game results out in batches
+            with profiling.stage('write'):
+                results.write(results_store.make_game_records(file_job['pgn_file'], game_number, headers, scoring_system, *game_result, counts, content_hash, results_settings))
+
+        try:
+            for pgn_file in pgn_files:
+                # Index the games; the checkpoint is keyed by game content, so a resumed run skips the games it already scored
+                pgn_path = os.path.join(folder, pgn_file)
+                index, changed = pgn_index.update_index(pgn_path)
+                changed = set(changed)
+                print(f"{pgn_file}: {len(index['games'])} games, {len(changed)} new or changed since the last index")
+
+                # Remove the file extension and create JSON and checkpoint file names;
+                # the checkpoint stays open until the last game of the file is merged
+                file_job = {
+                    'pgn_file': pgn_file,
+                    'json_file': os.path.join(folder, pgn_file[:-4] + '.json'),
+                    'index': index,
+                    'data': {
+                        "white_gi": 0,
+                        "black_gi": 0,
+                        "white_gpl": 0,
+                        "black_gpl": 0,
+                        "white_move_number": 0,
+                        "black_move_number": 0,
+                    },
+                    'checkpoint': CheckpointLog(os.path.join(folder, pgn_file[:-4] + '.checkpoint.jsonl'), checkpoint_settings),
+                }
+                pending.append((file_job, None, None, None, None))
+
+                # Iterate through each game in the PGN file
+                for game_number, (offset, length, header_digest, content_hash) in enumerate(index['games']):
+                    previous = previous_results.get((pgn_file, content_hash)) if game_number not in changed else None
+                    if previous is not None:
+                        # An unchanged game only needs its headers for the new records
+                        with profiling.stage('parse'):
+                            game_headers = chess.pgn.read_headers(io.StringIO(pgn_index.read_game_text(pgn_path, index, game_number)))
+                        if game_headers is None:
+                            continue
+                        # Missing Seven Tag Roster headers are '?' as in a parsed game
+                        headers = chess.pgn.Headers()
+                        headers.update(game_headers)
+                        future = concurrent.futures.Future()
+                        future.set_result(previous)
+                    else:
+                        with profiling.stage('parse'):
+                            game = pgn_index.read_game_at(pgn_path, index, game_number)
+                        if game is None:
+                            continue
+                        headers = game.headers
+
+                        # Calculate GI and GPL for the current game on the next idle engine
+                        future = pool.submit(game_scorer, game, t, n, scoring_system, cache, file_job['checkpoint'], content_hash, known)
+                    # Keep the end-of-file marker behind the games of its file
+                    pending.insert(len(pending) - 1, (file_job, game_number, headers, content_hash, future))
+                    while len(pending) > window:
+                        collect_oldest()
+            while pending:
+                collect_oldest()
+        finally:
+            # The checkpoints of unfinished files are kept for the next run
+            for file_job, game_number, headers, content_hash, future in pending:
+                file_job['checkpoint'].close()
 
-        # Close the chess engine
-        engine.quit()
+        # Report how much engine work the cache saved
+        print(cache.report())
+        if pool.restarts():
+            print(f"Engines restarted after a crash: {pool.restarts()}")
+        if syzygy_path or opening_table:
+            print(known.report())
+        if adaptive:
+            print(adaptive_stats.report())
+        profiling.note('cache hit rate', f"{cache.hit_rate():.1%}")
+        profiling.report(trace_file)
 
 # Call the main function
 if __name__ == "__main__":
@@ -4,9 +4,21 @@
 # Import the necessary libraries
 import json
 import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
 import chess.pgn
-from chess.engine import Cp, Mate, MateGiven, Wdl
+from chess.engine import Mate, MateGiven, Wdl
 import chess.engine
+import pgn_stream
+import pgn_shards
+import profiling
+import results_store
+import wdl_models
+# The vectorized kernel needs NumPy; fall back to the per-ply loop without it
+try:
+    import wdl_kernel
+except ImportError:
+    wdl_kernel = None
 
 # Function to load the JSON file
 def load_json_file(json_file):
@@ -67,11 +79,13 @@ def calculate_expected_value(win_prob, draw_prob, loss_prob, turn, scoring_syste
 
 # Function to extract %eval from comments
 def extract_eval_from_node(node):
-    if node.eval():
-        eval_value = node.eval().relative
+    # Parse the comment only once
+    pov_score = node.eval()
+    if pov_score:
+        eval_value = pov_score.relative
         if eval_value.is_mate():
-            # If it's a mate for us, return +10, if it's against us, return -10
-            return 10 if eval_value.mate() > 0 else -10
+            # Mates keep their distance, so the WDL model can score them as mates
+            return pgn_stream.mate_pawns(eval_value.mate())
         else:
             # Otherwise, convert from centipawns to full points
             return eval_value.score() / 100.0
@@ -79,39 +93,82 @@ def extract_eval_from_node(node):
         return None
 
 
+# Function to calculate GI from the game result, or from the expectation of an unfinished game
+def calculate_final_gi(headers, scoring_system, white_gpl, black_gpl, white_gi, black_gi, postmove_exp_white, postmove_exp_black):
+    # Check if the game has a result
+    if 'Result' in headers and headers['Result'] != '*':
+        # Get the result of the game
+        result = headers['Result']
+        # If white won
+        if result == '1-0':
+            # Calculate GI for both players
+            if scoring_system == "NorwayChess":
+                white_gi = 3 - white_gpl
+                black_gi = -black_gpl
+            # If the scoring system is "Standard"
+            else:
+                white_gi = 1 - white_gpl
+                black_gi = -black_gpl
+        # If black won
+        elif result == '0-1':
+            # Calculate GI for both players
+            if scoring_system == "NorwayChess":
+                black_gi = 3 - black_gpl
+                white_gi = -white_gpl
+            # If the scoring system is "Standard"
+            else:
+                black_gi = 1 - black_gpl
+                white_gi = -white_gpl
+        elif result == '1/2-1/2':
+            # If it's a draw, calculate GI for both players
+            if scoring_system == "NorwayChess":
+                white_gi = 1.25 - white_gpl
+                black_gi = 1.25 - black_gpl
+            # If the scoring system is "Standard"
+            else:
+                white_gi = 0.5 - white_gpl
+                black_gi = 0.5 - black_gpl
+    else:
+        # Calculate (expected) GI for both players
+        white_gi = postmove_exp_white - white_gpl
+        black_gi = postmove_exp_black - black_gpl
+    return white_gi, black_gi
+
 # Function to calculate GI and GPL
 
-def calculate_gi(move_number, game, white_gpl, black_gpl, white_gi, black_gi, white_move_number, black_move_number, scoring_system, counts):
+def calculate_gi(move_number, game, white_gpl, black_gpl, white_gi, black_gi, white_move_number, black_move_number, scoring_system, counts, wdl_model=None):
+    model = wdl_models.get_model(wdl_model)
     # Try to create a game from the current game
     node = game
+    # Only the root board is built; the side to move then alternates with every ply
+    turn = "White" if game.board().turn == chess.WHITE else "Black"
     # Iterate through all the moves in the game
     while not node.is_end():
         premove_eval = extract_eval_from_node(node)
         if premove_eval is None:
-            premove_eval = Cp(30)
+            premove_eval = 30
         else:
-            premove_eval = Cp(int(100*premove_eval))
-        win_draw_loss = premove_eval.wdl()
+            premove_eval = int(100*premove_eval)
+        win_draw_loss = model.wdl(premove_eval)
         # print("premove: win_draw_loss",win_draw_loss)
         win_prob, draw_prob, loss_prob = win_draw_loss.wins / 1000, win_draw_loss.draws / 1000, win_draw_loss.losses / 1000
-        turn = "White" if node.board().turn == chess.WHITE else "Black"
         premove_exp_white, premove_exp_black = calculate_expected_value(
             win_prob, draw_prob, loss_prob, turn, scoring_system)
         # Make the move on the board
         next_node = node.variation(0)
         #print("premove_eval", premove_eval)
         node = next_node
+        turn = "Black" if turn == "White" else "White"
         # Get the %eval from the comment after the move
         postmove_eval = extract_eval_from_node(node)
-        postmove_eval = Cp(int(100*postmove_eval))
+        postmove_eval = int(100*postmove_eval)
         # Get the expectation for both players after making the move
-        win_draw_loss = postmove_eval.wdl()
+        win_draw_loss = model.wdl(postmove_eval)
         # print("postmove: win_draw_loss",win_draw_loss)
         win_prob, draw_prob, loss_prob = win_draw_loss.wins / 1000, win_draw_loss.draws / 1000, win_draw_loss.losses / 1000
-        turn = "White" if node.board().turn == chess.WHITE else "Black"
         postmove_exp_white, postmove_exp_black = calculate_expected_value(win_prob, draw_prob, loss_prob, turn, scoring_system)
         # If it's black's turn
-        if node.board().turn == chess.BLACK:
+        if turn == "Black":
             # Define expected point loss of white's move
             exp_white_point_loss = premove_exp_white - postmove_exp_white
             """print("exp_white_point_loss", exp_white_point_loss)
@@ -144,43 +201,29 @@ def calculate_gi(move_number, game, white_gpl, black_gpl, white_gi, black_gi, wh
                 counts['black_inaccuracy'] += 1
             # Update black's move number
             black_move_number += 1
-        # Check if the game has a result
-        if 'Result' in game.headers and game.headers['Result'] != '*':
-            # Get the result of the game
-            result = game.headers['Result']
-            # If white won
-            if result == '1-0':
-                # Calculate GI for both players
-                if scoring_system == "NorwayChess":
-                    white_gi = 3 - white_gpl
-                    black_gi = -black_gpl
-                # If the scoring system is "Standard"
-                else:
-                    white_gi = 1 - white_gpl
-                    black_gi = -black_gpl
-            # If black won
-            elif result == '0-1':
-                # Calculate GI for both players
-                if scoring_system == "NorwayChess":
-                    black_gi = 3 - black_gpl
-                    white_gi = -white_gpl
-                # If the scoring system is "Standard"
-                else:
-                    black_gi = 1 - black_gpl
-                    white_gi = -white_gpl
-            elif result == '1/2-1/2':
-                # If it's a draw, calculate GI for both players
-                if scoring_system == "NorwayChess":
-                    white_gi = 1.25 - white_gpl
-                    black_gi = 1.25 - black_gpl
-                # If the scoring system is "Standard"
-                else:
-                    white_gi = 0.5 - white_gpl
-                    black_gi = 0.5 - black_gpl
-        else:
-            # Calculate (expected) GI for both players
-            white_gi = postmove_exp_white - white_gpl
-            black_gi = postmove_exp_black - black_gpl
+        # Update GI for both players from the result or the latest expectation
+        white_gi, black_gi = calculate_final_gi(game.headers, scoring_system, white_gpl, black_gpl, white_gi, black_gi, postmove_exp_white, postmove_exp_black)
+    return white_gi, black_gi, white_gpl, black_gpl, white_move_number, black_move_number, counts
+
+# Function to calculate GI and GPL from the headers and evals of a game, as read by pgn_stream
+def calculate_gi_from_evals(headers, evals, white_starts, white_gpl, black_gpl, white_gi, black_gi, white_move_number, black_move_number, scoring_system, counts, wdl_model=None):
+    if len(evals) < 2:
+        return white_gi, black_gi, white_gpl, black_gpl, white_move_number, black_move_number, counts
+    plies = wdl_kernel.score_game(evals, white_starts, scoring_system, model=wdl_model)
+
+    # Sum the point losses and flags of each player
+    white_moves = plies["white_moved"]
+    black_moves = plies["is_move"] & ~white_moves
+    white_gpl += float(plies["point_loss"][white_moves].sum())
+    black_gpl += float(plies["point_loss"][black_moves].sum())
+    white_move_number += int(white_moves.sum())
+    black_move_number += int(black_moves.sum())
+    for kind in ("blunder", "mistake", "inaccuracy"):
+        counts[f"white_{kind}"] += int(plies[kind][white_moves].sum())
+        counts[f"black_{kind}"] += int(plies[kind][black_moves].sum())
+
+    # Update GI for both players from the result or the final expectation
+    white_gi, black_gi = calculate_final_gi(headers, scoring_system, white_gpl, black_gpl, white_gi, black_gi, float(plies["expected_white"][-1]), float(plies["expected_black"][-1]))
     return white_gi, black_gi, white_gpl, black_gpl, white_move_number, black_move_number, counts
 
 # Function to save the PGN file
@@ -191,8 +234,8 @@ def save_pgn_file(game, new_pgn_file):
         print(game, file=fgame)
 
 # Function to update the JSON file
-def update_json_file(json_file, white_gpl, black_gpl, white_move_number, black_move_number, white_gi, black_gi, game, counts):
-    Result = game.headers.get("Result", None)
+def update_json_file(json_file, white_gpl, black_gpl, white_move_number, black_move_number, white_gi, black_gi, headers, counts):
+    Result = headers.get("Result", None)
     if Result == '1-0':
         whiteResult = 1
         blackResult = 0
@@ -207,11 +250,11 @@ def update_json_file(json_file, white_gpl, black_gpl, white_move_number, black_m
         blackResult = '...'
     # Create a dictionary with the data to be saved
     
-    date = None
-    if "UTCDate" in game.headers:
-        dates = game.headers["UTCDate"]
-    elif "Date" in game.headers:
-        dates = game.headers["Date"]
+    dates = None
+    if "UTCDate" in headers:
+        dates = headers["UTCDate"]
+    elif "Date" in headers:
+        dates = headers["Date"]
     
     white_avg_gpl = white_gpl / white_move_number
     black_avg_gpl = black_gpl / black_move_number
@@ -223,14 +266,14 @@ def update_json_file(json_file, white_gpl, black_gpl, white_move_number, black_m
         "black_gpl": round(black_gpl, 2),
         "white_move_number": white_move_number,
         "black_move_number": black_move_number,
-        "White": game.headers.get("White", None),
-        "Black": game.headers.get("Black", None),
-        "Event": game.headers.get("Event", None),
-        "Site": game.headers.get("Site", None),
+        "White": headers.get("White", None),
+        "Black": headers.get("Black", None),
+        "Event": headers.get("Event", None),
+        "Site": headers.get("Site", None),
         "Date": dates,
-        "Round": game.headers.get("Round", None),
-        "WhiteElo": game.headers.get("WhiteElo", None),
-        "BlackElo": game.headers.get("BlackElo", None),
+        "Round": headers.get("Round", None),
+        "WhiteElo": headers.get("WhiteElo", None),
+        "BlackElo": headers.get("BlackElo", None),
         "whiteResult": whiteResult,
         "blackResult": blackResult,
         "counts": counts
@@ -240,55 +283,152 @@ def update_json_file(json_file, white_gpl, black_gpl, white_move_number, black_m
     with open(json_file, "w") as json_output_file:
         json.dump(data, json_output_file, indent=4)
 
+# Function to get zero blunder, mistake and inaccuracy counts
+def zero_counts():
+    return {
+        "white_blunder": 0,
+        "black_blunder": 0,
+        "white_mistake": 0,
+        "black_mistake": 0,
+        "white_inaccuracy": 0,
+        "black_inaccuracy": 0,
+    }
+
+# Function to score each game of a PGN stream on its own, yielding (headers, game result)
+def score_games_in_stream(pgn, scoring_system, wdl_model=None):
+    # With NumPy, stream headers and evals only and score whole games at once
+    if wdl_kernel:
+        for headers, evals in profiling.timed_iter('parse', pgn_stream.read_eval_games(pgn)):
+            # GI stays None for a game without moves
+            with profiling.stage('score'):
+                game_result = calculate_gi_from_evals(
+                    headers, evals, pgn_stream.white_starts(headers), 0, 0, None, None, 0, 0, scoring_system, zero_counts(), wdl_model)
+            yield headers, game_result
+    else:
+        # Iterate through each game in the stream
+        while True:
+            with profiling.stage('parse'):
+                game = chess.pgn.read_game(pgn)
+            if game is None:
+                break
+            with profiling.stage('score'):
+                game_result = calculate_gi(0, game, 0, 0, None, None, 0, 0, scoring_system, zero_counts(), wdl_model)
+            yield dict(game.headers), game_result
+
+# Function to score the games in one byte range of a PGN file, starting from zero totals
+def score_shard(path, start, end, scoring_system, profile=False, wdl_model=None, trace=False):
+    # Worker processes profile their own shard and send the snapshot back with the results
+    if profile:
+        profiling.enable(trace)
+    # GI stays None until a game with moves sets it
+    totals = {
+        "white_gi": None,
+        "black_gi": None,
+        "white_gpl": 0,
+        "black_gpl": 0,
+        "white_move_number": 0,
+        "black_move_number": 0,
+        "counts": zero_counts(),
+    }
+    first_headers = None
+    games = 0
+    # The records go to a temporary JSON lines file as they are made, so a shard of any size is never held in memory
+    # or pickled back; the parent process copies the files to the results store in shard order and deletes them
+    records_fd, records_path = tempfile.mkstemp(prefix='gi-shard-', suffix='.jsonl')
+    with open(records_fd, 'w') as records_file, pgn_shards.read_shard(path, start, end) as pgn:
+        for game_number, (headers, game_result) in enumerate(score_games_in_stream(pgn, scoring_system, wdl_model)):
+            if first_headers is None:
+                first_headers = headers
+            totals = merge_shard_result(totals, game_result)
+            # Per-game, per-player records; game numbers are relative to the shard
+            for record in results_store.make_game_records(os.path.basename(path), game_number, headers, scoring_system, *game_result):
+                records_file.write(json.dumps(record) + '\n')
+            games += 1
+            profiling.count('games')
+            profiling.count('plies', game_result[4] + game_result[5])
+    shard_result = (totals['white_gi'], totals['black_gi'], totals['white_gpl'], totals['black_gpl'],
+                    totals['white_move_number'], totals['black_move_number'], totals['counts'])
+    return first_headers, shard_result, records_path, games, profiling.snapshot() if profile else None
+
+# Function to copy the records a shard wrote to its temporary file to the results store and delete the file
+def copy_shard_records(records_path, results, games_before):
+    try:
+        with open(records_path) as records_file:
+            for line in records_file:
+                record = json.loads(line)
+                # Number the games across the whole file
+                record['game'] += games_before
+                results.write([record])
+    finally:
+        os.remove(records_path)
+
+# Function to merge the totals of one game or shard into the running totals, in file order
+def merge_shard_result(data, shard_result):
+    white_gi, black_gi, white_gpl, black_gpl, white_move_number, black_move_number, counts = shard_result
+    data['white_gpl'] += white_gpl
+    data['black_gpl'] += black_gpl
+    data['white_move_number'] += white_move_number
+    data['black_move_number'] += black_move_number
+    for key in counts:
+        data['counts'][key] += counts[key]
+    # GI is the points of the latest scored game minus the running GPL
+    if white_gi is not None:
+        data['white_gi'] = white_gi + white_gpl - data['white_gpl']
+    if black_gi is not None:
+        data['black_gi'] = black_gi + black_gpl - data['black_gpl']
+    return data
+
 # Main function
-def main():
-    folder = 'input_folder_path'
-    output_directory = 'output_folder_path'
+def main(folder='input_folder_path', output_directory='output_folder_path',
+         # Set the scoring system: 'NorwayChess' or 'Standard'. NorwayChess uses (3, 1.25, 0) scoring system, while Standard system is (1, 0.5, 0)
+         scoring_system='NorwayChess',
+         # Number of worker processes; large files are split into this many shards on game boundaries
+         workers=1,
+         # Per-game, per-player results (default results.parquet in the output directory; Parquet with pyarrow, CSV otherwise)
+         results_file=None,
+         # WDL model: a name from wdl_models.MODELS such as 'sf' or 'lichess', or the .json file of a calibrated model
+         wdl_model='sf',
+         # Time PGN parsing, scoring and writing, print a summary at the end and optionally save a Chrome trace (see profiling.py)
+         profile=False, trace_file=None):
     os.makedirs(output_directory, exist_ok=True)
-    # Set the scoring system: 'NorwayChess' or 'Standard'. NorwayChess uses (3, 1.25, 0) scoring system, while Standard system is (1, 0.5, 0)
-    scoring_system = 'NorwayChess'
+    if results_file is None:
+        results_file = os.path.join(output_directory, 'results.parquet')
+    # Fail on an unknown model before any worker starts; the workers get the name and build their own tables
+    wdl_models.get_model(wdl_model)
 
+    if profile:
+        profiling.enable(trace=trace_file is not None)
     # Get all the .pgn files in the folder
     pgn_files = [f for f in os.listdir(folder) if f.endswith('.pgn')]
     # print(pgn_files)
-    # Iterate through each PGN file
-    for pgn_file in pgn_files:
-        # Remove the file extension and create JSON and new PGN file names
-        new_file = pgn_file[:-4]
-        json_file = os.path.join(output_directory, new_file + '.json')
-        
-
-        # Open the PGN file
-        pgn = open(os.path.join(folder, pgn_file))
+    with ProcessPoolExecutor(max_workers=workers) as executor, results_store.ResultsWriter(results_file) as results:
+        # Iterate through each PGN file
+        for pgn_file in pgn_files:
+            # Remove the file extension and create JSON and new PGN file names
+            new_file = pgn_file[:-4]
+            json_file = os.path.join(output_directory, new_file + '.json')
 
-        # Load data from the JSON file
-        data = load_json_file(json_file)
-        white_gi = data['white_gi']
-        black_gi = data['black_gi']
-        white_gpl = data['white_gpl']
-        black_gpl = data['black_gpl']
-        white_move_number = data['white_move_number']
-        black_move_number = data['black_move_number']
-        counts = data['counts']
-
-        # Initialize variables
-        move_number = 0
-        # Iterate through each game in the PGN file
-        while True:
-            game = chess.pgn.read_game(pgn)
-            # print(game)
-            if game is None:
-                break
+            # Load data from the JSON file
+            data = load_json_file(json_file)
 
-            # Calculate GI and GPL for the current game
-            white_gi, black_gi, white_gpl, black_gpl, white_move_number, black_move_number, counts = calculate_gi(
-                move_number, game, white_gpl, black_gpl, white_gi, black_gi, white_move_number, black_move_number, scoring_system, counts)
+            # Score the shards in parallel and merge them back in file order
+            first_headers = None
+            games_before = 0
+            for headers, shard_result, records_path, games, shard_profile in pgn_shards.map_shards(executor, score_shard, os.path.join(folder, pgn_file), workers, scoring_system, profile, wdl_model, trace_file is not None):
+                profiling.merge(shard_profile)
+                if first_headers is None:
+                    first_headers = headers
+                data = merge_shard_result(data, shard_result)
+                # Stream the records out, numbering the games across the whole file
+                with profiling.stage('write'):
+                    copy_shard_records(records_path, results, games_before)
+                games_before += games
 
-        # Read the game again
-        game = chess.pgn.read_game(open(os.path.join(folder, pgn_file)))
+            # Update the JSON file with the new data, using the headers of the first game
+            with profiling.stage('write'):
+                update_json_file(json_file, data['white_gpl'], data['black_gpl'], data['white_move_number'], data['black_move_number'], data['white_gi'], data['black_gi'], first_headers, data['counts'])
 
-        # Update the JSON file with the new data
-        update_json_file(json_file, white_gpl, black_gpl, white_move_number, black_move_number, white_gi, black_gi, game, counts)
+    profiling.report(trace_file)
 
 
 # Call the main function
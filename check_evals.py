@@ -1,37 +1,241 @@
+"""Check that every move of the PGN files in a directory tree has an %eval comment.
+
+scan_directory_for_pgn_files() prints one line per move without an eval.
+scan_coverage() gives a compact report instead: for every file and game the
+number of plies, the plies with an eval, the coverage ratio and the first
+ply without one, and the games with no evals at all. Only the comments are
+tokenised; no moves are parsed. The shards of all files are spread over
+worker processes, and with stop_at_first_gap a game is only scanned up to
+its first missing eval, so that its counts cover the plies up to the gap only
+and a game whose first ply has no eval counts as having no evals. Only the
+counts of each file are kept in memory; the per-game report is streamed to a
+JSON or CSV file as the shards finish."""
 import os
-import chess.pgn
+import csv
+import json
 import math
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+import chess.pgn
+import pgn_stream
+import pgn_shards
+
+def scan_directory_for_pgn_files(directory, workers=1):
+    # Large files are split into one shard per worker process
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # Recursively walk through directory and subdirectories
+        for folder_name, subfolders, file_names in os.walk(directory):
+            for file_name in file_names:
+                if file_name.endswith('.pgn'):
+                    file_path = os.path.join(folder_name, file_name)
+                    # Extract the subfolder name relative to the root directory
+                    relative_subfolder_name = os.path.relpath(folder_name, directory)
+                    scan_pgn_file_for_missing_eval(relative_subfolder_name, file_name, file_path, executor, workers)
 
-def scan_directory_for_pgn_files(directory):
-    # Recursively walk through directory and subdirectories
+def scan_shard_for_missing_eval(file_path, start, end):
+    missing = []
+    # Only the comments are read; no boards or game trees are built
+    with pgn_shards.read_shard(file_path, start, end) as pgn:
+        for headers, evals in pgn_stream.read_eval_games(pgn):
+            # Check if '%eval' comment is present
+            missing.append([move_number for move_number, value in enumerate(evals[1:], start=1) if value is None])
+    return missing
+
+def scan_pgn_file_for_missing_eval(subfolder_name, file_name, file_path, executor=None, shards=1):
+    if executor is None:
+        shard_results = [scan_shard_for_missing_eval(file_path, start, end) for start, end in pgn_shards.make_shards(file_path, 1)]
+    else:
+        shard_results = pgn_shards.map_shards(executor, scan_shard_for_missing_eval, file_path, shards)
+    # Report the games in file order
+    for missing in shard_results:
+        for game_missing in missing:
+            for move_number in game_missing:
+                print(f'Missing %eval in subfolder "{subfolder_name}", file "{file_name}", move {math.ceil(move_number/2)}')
+
+# Function to find the PGN files of a directory and its subdirectories in a stable order
+def find_pgn_files(directory):
     for folder_name, subfolders, file_names in os.walk(directory):
-        for file_name in file_names:
+        subfolders.sort()
+        for file_name in sorted(file_names):
             if file_name.endswith('.pgn'):
-                file_path = os.path.join(folder_name, file_name)
-                # Extract the subfolder name relative to the root directory
-                relative_subfolder_name = os.path.relpath(folder_name, directory)
-                scan_pgn_file_for_missing_eval(relative_subfolder_name, file_name, file_path)
-
-def scan_pgn_file_for_missing_eval(subfolder_name, file_name, file_path):
-    with open(file_path, 'r', encoding='utf-8') as pgn_file:
-        game_number = 0
-        while True:
-            game = chess.pgn.read_game(pgn_file)
-            if game is None:
-                # End of file
-                break
-            game_number += 1
-            node = game
-            move_number = 0
-            while not node.is_end():
-                move_number += 1
-                node = node.next()
-                # Check if '%eval' comment is present
-                comment = node.comment
-                if '%eval' not in comment:
-                    print(f'Missing %eval in subfolder "{subfolder_name}", file "{file_name}", move {math.ceil(move_number/2)}')
+                yield os.path.join(folder_name, file_name)
+
+# Function to count the plies of a game's movetext and the plies followed by an %eval comment,
+# returning (plies, evals, first ply without an eval or None)
+def eval_coverage(movetext, stop_at_first_gap=False):
+    plies = 0
+    evals = 0
+    first_missing = None
+    has_eval = False
+    depth = 0
+    for token in pgn_stream.TOKEN_REGEX.finditer(movetext):
+        if token.group('open'):
+            depth += 1
+        elif token.group('close'):
+            depth = max(0, depth - 1)
+        elif depth:
+            # Comments inside a variation belong to its moves
+            continue
+        elif token.group('comment') is not None:
+            if not has_eval and chess.pgn.EVAL_REGEX.search(token.group('comment')):
+                has_eval = True
+        elif token.group('move'):
+            # A new move settles whether the previous one had an eval
+            if plies:
+                if has_eval:
+                    evals += 1
+                elif first_missing is None:
+                    first_missing = plies
+                    if stop_at_first_gap:
+                        return plies, evals, first_missing
+            plies += 1
+            has_eval = False
+    if plies:
+        if has_eval:
+            evals += 1
+        elif first_missing is None:
+            first_missing = plies
+    return plies, evals, first_missing
+
+# Function to get the coverage counts of one byte range of a file and, with keep_games, the path of a temporary
+# JSON lines file holding [White, Black, plies, evals, first missing ply] for each of its games
+def scan_shard_coverage(file_path, start, end, stop_at_first_gap=False, keep_games=False):
+    counts = {'games': 0, 'plies': 0, 'evals': 0, 'games_with_gaps': 0, 'games_without_evals': 0}
+    games_path = None
+    games_file = None
+    if keep_games:
+        # The games go to a temporary file as they are scanned, so a shard of any size is never held in memory
+        # or pickled back; the parent process copies them to the report in shard order and deletes the file
+        games_fd, games_path = tempfile.mkstemp(prefix='coverage-shard-', suffix='.jsonl')
+        games_file = open(games_fd, 'w')
+    try:
+        with pgn_shards.read_shard(file_path, start, end) as pgn:
+            for headers, movetext in pgn_stream.read_raw_games(pgn):
+                plies, evals, first_missing = eval_coverage(movetext, stop_at_first_gap)
+                counts['games'] += 1
+                counts['plies'] += plies
+                counts['evals'] += evals
+                counts['games_with_gaps'] += first_missing is not None
+                counts['games_without_evals'] += bool(plies and not evals)
+                if games_file:
+                    games_file.write(json.dumps([headers['White'], headers['Black'], plies, evals, first_missing]) + '\n')
+    finally:
+        if games_file:
+            games_file.close()
+    return counts, games_path
+
+# Function to yield the games a shard wrote to its temporary file and delete the file
+def read_shard_games(games_path):
+    try:
+        with open(games_path) as games_file:
+            for line in games_file:
+                yield json.loads(line)
+    finally:
+        os.remove(games_path)
+
+# Writer of a coverage report as JSON, or as CSV with one row per game if the file name ends with .csv.
+# Games are written as they arrive and each file's summary after its last game
+class CoverageReport:
+    def __init__(self, path):
+        self.csv = path.endswith('.csv')
+        self.handle = open(path, 'w', newline='' if self.csv else None)
+        self.files = 0
+        if self.csv:
+            self.writer = csv.writer(self.handle)
+            self.writer.writerow(['file', 'game', 'white', 'black', 'plies', 'evals', 'coverage', 'first_missing_ply'])
+        else:
+            self.handle.write('{"files": [')
+
+    def start_file(self, file_path):
+        self.games = 0
+        if not self.csv:
+            self.handle.write((',' if self.files else '') + '\n    {"file": ' + json.dumps(file_path) + ', "game_details": [')
+        self.file_path = file_path
+        self.files += 1
+
+    def write_game(self, number, white, black, plies, evals, first_missing):
+        coverage = evals / plies if plies else 1.0
+        if self.csv:
+            self.writer.writerow([self.file_path, number, white, black, plies, evals, f"{coverage:.4f}", '' if first_missing is None else first_missing])
+        else:
+            game = {'game': number, 'white': white, 'black': black, 'plies': plies, 'evals': evals,
+                    'coverage': coverage, 'first_missing_ply': first_missing}
+            self.handle.write((',' if self.games else '') + '\n        ' + json.dumps(game))
+        self.games += 1
+
+    def end_file(self, summary):
+        if not self.csv:
+            totals = json.dumps({key: value for key, value in summary.items() if key != 'file'})
+            self.handle.write('\n    ], ' + totals[1:])
+
+    def close(self):
+        if not self.csv:
+            self.handle.write('\n]}\n')
+        self.handle.close()
+
+# Function to scan every PGN file in a directory tree for eval coverage, with the shards of all files spread over the workers.
+# Only the counts of each file are kept; with report_file the games are streamed to the report (see CoverageReport)
+def scan_coverage(directory, workers=1, stop_at_first_gap=False, report_file=None):
+    report = CoverageReport(report_file) if report_file else None
+    files = []
+    jobs = []
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            # Large files are split into one shard per worker process
+            for file_path in find_pgn_files(directory):
+                futures = [executor.submit(scan_shard_coverage, file_path, start, end, stop_at_first_gap, report is not None)
+                           for start, end in pgn_shards.make_shards(file_path, workers)]
+                jobs.append((os.path.relpath(file_path, directory), futures))
+            for file_path, futures in jobs:
+                summary = {'file': file_path, 'games': 0, 'plies': 0, 'evals': 0, 'games_with_gaps': 0, 'games_without_evals': 0}
+                if report:
+                    report.start_file(file_path)
+                for future in futures:
+                    counts, games_path = future.result()
+                    if games_path:
+                        # Number the games across the whole file
+                        for number, game in enumerate(read_shard_games(games_path), start=summary['games']):
+                            report.write_game(number, *game)
+                    for key, value in counts.items():
+                        summary[key] += value
+                summary['coverage'] = summary['evals'] / summary['plies'] if summary['plies'] else 1.0
+                if report:
+                    report.end_file(summary)
+                files.append(summary)
+    finally:
+        if report:
+            report.close()
+        # The executor has waited for every shard, so the temporary files of shards that were not copied
+        # to the report after an error can be removed
+        for file_path, futures in jobs:
+            for future in futures:
+                if not future.cancelled() and future.exception() is None:
+                    games_path = future.result()[1]
+                    if games_path and os.path.exists(games_path):
+                        os.remove(games_path)
+    return files
+
+# Function to format the file summaries of a coverage scan as a few lines of text
+def coverage_summary(files):
+    lines = []
+    for report in files:
+        if report['games_with_gaps']:
+            lines.append(f"{report['file']}: {report['coverage']:.1%} of {report['plies']} plies, "
+                         f"{report['games_with_gaps']} of {report['games']} games with gaps, {report['games_without_evals']} without evals")
+    plies = sum(report['plies'] for report in files)
+    evals = sum(report['evals'] for report in files)
+    complete = sum(1 for report in files if not report['games_with_gaps'])
+    lines.append(f"{len(files)} files, {complete} complete, {evals} of {plies} plies with an eval ({evals / plies if plies else 1.0:.1%})")
+    return '\n'.join(lines)
 
 # Example usage:
 # Replace 'path_to_directory' with the path of your directory containing subfolders with PGN files
-path_to_directory = 'path_here'
-scan_directory_for_pgn_files(path_to_directory)
+if __name__ == "__main__":
+    path_to_directory = 'path_here'
+    # Number of worker processes, and an optional .json or .csv file for the full per-game report
+    workers = 1
+    report_file = None
+    # Only scan each game up to its first missing eval
+    stop_at_first_gap = False
+    files = scan_coverage(path_to_directory, workers, stop_at_first_gap, report_file)
+    print(coverage_summary(files))
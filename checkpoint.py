@@ -0,0 +1,89 @@
+"""Per-game, per-ply checkpoint log for long engine runs.
+
+Every analysed position is appended as one JSON line keyed by a game key
+(the content hash from pgn_index) and ply, so an interrupted run
+resumes at the exact game and ply where it stopped and the cost of a
+checkpoint does not grow with the size of the run.
+
+The first line holds the settings of the run that wrote the log (engine,
+search limit, analysis mode, WDL model). A log written under other settings
+is discarded instead of resumed, and remove() deletes the log once the file
+it belongs to is finished."""
+
+# Import the necessary libraries
+import json
+import os
+import threading
+import chess.engine
+from chess.engine import Wdl
+
+
+class CheckpointLog:
+    def __init__(self, path, settings=None):
+        self.path = path
+        # JSON round trip, so that tuples compare equal to the lists read back from the log
+        self.settings = json.loads(json.dumps(settings or {}))
+        self.entries = {}
+        torn = False
+        # Load the positions analysed by earlier runs with the same settings
+        if os.path.exists(path):
+            with open(path) as log:
+                header = None
+                for line in log:
+                    torn = not line.endswith('\n')
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # A run killed in the middle of a write leaves a torn last line
+                        continue
+                    if header is None:
+                        header = record
+                        if record.get('settings') != self.settings:
+                            break
+                        continue
+                    self.entries[(record['game'], record['ply'])] = tuple(record['wdl'])
+            if header is None or header.get('settings') != self.settings:
+                # Positions analysed with another engine, limit, mode or model are worthless here
+                os.remove(path)
+                torn = False
+        new = not os.path.exists(path)
+        # Appends of a single short line through O_APPEND are atomic
+        self.fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        # Start a fresh line after a torn one so the next record stays readable
+        if torn:
+            os.write(self.fd, b'\n')
+        if new:
+            os.write(self.fd, (json.dumps({'settings': self.settings}) + '\n').encode())
+        self.lock = threading.Lock()
+
+    # Return the logged WDL of a position from the side to move's point of view, or None
+    def get(self, game_key, ply, turn):
+        wdl = self.entries.get((game_key, ply))
+        if wdl is None:
+            return None
+        return chess.engine.PovWdl(Wdl(*wdl), turn)
+
+    # Append the WDL of an analysed position and make sure it reaches the disk
+    def record(self, game_key, ply, win_draw_loss):
+        wdl = tuple(win_draw_loss.relative)
+        line = json.dumps({'game': game_key, 'ply': ply, 'wdl': wdl}) + '\n'
+        with self.lock:
+            os.write(self.fd, line.encode())
+            os.fsync(self.fd)
+            self.entries[(game_key, ply)] = wdl
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    # Close and delete the log once every game it covers has been scored
+    def remove(self):
+        self.close()
+        os.remove(self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -1,34 +1,103 @@
+"""Normalise PGN files whose eval comments lack brackets, e.g. {%eval 0.3}, and
+whose black moves repeat the white move number, into PGN python-chess reads.
+
+The file is read and written one game at a time, so memory does not grow with
+the size of the file. A game's movetext is cut into tokens and a small state
+machine keeps track of variation depth. Each rule can be turned off:
+
+    bracket_comments    {%eval 0.3} becomes {[%eval 0.3]}
+    strip_variations    variations are removed, including nested ones
+    strip_nags          NAGs such as $1 are removed; the comment after one is kept
+    black_move_numbers  the second "1." of a move number becomes "1..."
+
+Unlike the old regex rules, removing a NAG no longer removes the text up to
+the next closing brace: the old rule deleted the comment after a NAG, and with
+it the %eval of an annotated move, as well as any moves before that comment.
+Only the NAG token itself is dropped now, on purpose."""
 import re
 
-def update_chess_string(s):
-    parts = re.split(r'(\d+\.\s)', s)  # split by "number-dot-space", keeping delimiters
-    for i in range(1, len(parts), 2):  # process only "number-dot-space" parts
-        if i % 4 == 1:  # if it's a white move, keep it as is
-            continue
-        parts[i] = parts[i].replace('.', '...')  # if it's a black move, replace '.' with '...'
-    return ''.join(parts)  # join the parts back together
+# Movetext tokens: comments, rest-of-line comments, variations, NAGs, move numbers, and anything else
+TOKEN_REGEX = re.compile(r"""
+    (?P<comment>\{[^}]*\}?)
+    |(?P<line_comment>;[^\n]*)
+    |(?P<open>\()
+    |(?P<close>\))
+    |(?P<nag>\$\d+)
+    |(?P<number>\d+)(?P<dots>\.+)
+    |[^{;()$\s]+|\s+|.
+    """, re.VERBOSE)
 
-def add_brackets(s):
-    s = s.replace('{', '{[')
-    s = s.replace('}', ']}')
-    return s
 
-def remove_dollar_content(s):
-    return re.sub(r'\$.*?\}', '', s)
+# Function to normalise the movetext of one game
+def normalise_movetext(movetext, bracket_comments=True, strip_variations=True, strip_nags=True, black_move_numbers=True):
+    output = []
+    depth = 0
+    # The last move number seen in the mainline and in each enclosing variation, and the one before it
+    last_numbers = [[None, None]]
+    for token in TOKEN_REGEX.finditer(movetext):
+        text = token.group()
+        if token.group('open'):
+            depth += 1
+            # A variation replaces the last move, so it starts from the move number before that move
+            last_numbers.append([last_numbers[-1][1], None])
+            if strip_variations:
+                continue
+        elif token.group('close'):
+            if depth:
+                depth -= 1
+                last_numbers.pop()
+            if strip_variations:
+                continue
+        elif depth and strip_variations:
+            # Everything inside a variation goes with it
+            continue
+        elif token.group('comment') is not None:
+            content = text[1:-1] if text.endswith('}') else text[1:]
+            # Comments that already start with a bracket are left alone
+            if bracket_comments and not content.lstrip().startswith('['):
+                text = '{[' + content + ']}'
+        elif token.group('nag') and strip_nags:
+            continue
+        elif token.group('number'):
+            # A move number seen twice in a row is Black's move
+            number = token.group('number')
+            if black_move_numbers and token.group('dots') == '.' and number == last_numbers[-1][0]:
+                text = number + '...'
+            last_numbers[-1] = [number, last_numbers[-1][0]]
+        output.append(text)
+    return ''.join(output)
 
-def remove_parentheses_content(s):
-    return re.sub(r'\(.*?\)', '', s)
 
-input_pgn = 'enter_path_here'
+# Function to split a PGN stream into games, yielding (header lines, movetext) one game at a time
+def read_games(handle):
+    headers = []
+    movetext = []
+    in_comment = False
+    for line in handle:
+        # A line starting with [ is a header unless it is inside a multi-line comment
+        if not in_comment and line.startswith('['):
+            if movetext:
+                yield ''.join(headers), ''.join(movetext)
+                headers, movetext = [], []
+            headers.append(line)
+            continue
+        movetext.append(line)
+        # Comments do not nest, so the last brace on the line tells whether one is still open
+        opening, closing = line.rfind('{'), line.rfind('}')
+        if opening != closing:
+            in_comment = opening > closing
+    if headers or movetext:
+        yield ''.join(headers), ''.join(movetext)
 
-with open(input_pgn, 'r') as pgn_file:
-    pgn_string = pgn_file.read()
 
-pgn_string = add_brackets(pgn_string)
-pgn_string = remove_parentheses_content(pgn_string)
-pgn_string = remove_dollar_content(pgn_string)
-corrected_pgn_string = update_chess_string(pgn_string)
+# Function to convert a PGN file with bracketless eval comments, variations and NAGs into a PGN python-chess reads
+def convert_pgn_file(input_pgn, output_pgn, bracket_comments=True, strip_variations=True, strip_nags=True, black_move_numbers=True):
+    with open(input_pgn, 'r') as pgn_file, open(output_pgn, 'w') as output_file:
+        for headers, movetext in read_games(pgn_file):
+            output_file.write(headers)
+            output_file.write(normalise_movetext(movetext, bracket_comments, strip_variations, strip_nags, black_move_numbers))
 
-output_pgn = 'enter_path_here'
-with open(output_pgn, 'w') as pgn_file:
-    pgn_file.write(corrected_pgn_string)
+if __name__ == "__main__":
+    input_pgn = 'enter_path_here'
+    output_pgn = 'enter_path_here'
+    convert_pgn_file(input_pgn, output_pgn)
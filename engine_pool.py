@@ -0,0 +1,174 @@
+"""Keep a fixed-size pool of long-lived UCI engine processes and send
+whole games or single positions to whichever engine is idle.
+
+Each engine runs in an EngineSession that is configured and warmed up once,
+decides when the engine may clear its hash, and restarts the engine if it
+crashes, searching the position that was in flight again."""
+
+# Import the necessary libraries
+import collections
+import itertools
+import queue
+from concurrent.futures import ThreadPoolExecutor
+import chess
+import chess.engine
+import profiling
+
+
+class EngineSession:
+    def __init__(self, engine_path, options=None, warm_up=True, hash_scope='event', max_restarts=3):
+        # hash_scope is 'game' (clear the hash before every game), 'event' (keep it between games of the same event)
+        # or 'batch' (never clear it)
+        if hash_scope not in ('game', 'event', 'batch'):
+            raise ValueError(f"Unknown hash scope {hash_scope!r}")
+        self.engine_path = engine_path
+        self.options = options or {}
+        self.warm_up = warm_up
+        self.hash_scope = hash_scope
+        # Restarts allowed for one position, and restarts so far
+        self.max_restarts = max_restarts
+        self.restarts = 0
+        # Searches answered, not counting warm-up
+        self.searches = 0
+        self.game = None
+        self.games = itertools.count()
+        self.engine = None
+        self._start()
+
+    def _start(self):
+        for attempt in range(self.max_restarts + 1):
+            try:
+                self.engine = chess.engine.SimpleEngine.popen_uci(self.engine_path)
+                # Options such as Threads and Hash are sent once per process
+                if self.options:
+                    self.engine.configure(self.options)
+                # A first short search loads the network and allocates the hash before the timed searches start
+                if self.warm_up:
+                    self.engine.analyse(chess.Board(), chess.engine.Limit(depth=1), game=self.game)
+                return
+            except chess.engine.EngineTerminatedError:
+                if attempt == self.max_restarts:
+                    raise
+                self._discard()
+
+    def _discard(self):
+        try:
+            self.engine.close()
+        except Exception:
+            pass
+        self.engine = None
+
+    @property
+    def id(self):
+        return self.engine.id
+
+    # Tell the session that a new game starts; the engine gets ucinewgame, which clears its hash, when the game key changes.
+    # clear_hash starts from an empty hash whatever the hash scope, e.g. so that two timed passes start alike
+    def start_game(self, headers, clear_hash=False):
+        if clear_hash:
+            self.game = object()
+        elif self.hash_scope == 'game':
+            self.game = next(self.games)
+        elif self.hash_scope == 'event':
+            self.game = (headers.get('Event'), headers.get('Site'))
+
+    # Search a position, restarting the engine and searching the position again if the engine died
+    def analyse(self, board, limit, **kwargs):
+        for attempt in range(self.max_restarts + 1):
+            try:
+                if self.engine is None:
+                    self.restarts += 1
+                    self._start()
+                with profiling.stage('engine'):
+                    info = self.engine.analyse(board, limit, game=self.game, **kwargs)
+                self.searches += 1
+                return info
+            except chess.engine.EngineTerminatedError:
+                # An engine that keeps dying on the same position is given up on
+                if attempt == self.max_restarts:
+                    raise
+                self._discard()
+
+    def configure(self, options):
+        self.options = {**self.options, **options}
+        self.engine.configure(options)
+
+    def quit(self):
+        if self.engine is None:
+            return
+        try:
+            self.engine.quit()
+        except chess.engine.EngineTerminatedError:
+            pass
+
+
+class EnginePool:
+    def __init__(self, engine_path, workers=1, options=None, warm_up=True, hash_scope='event'):
+        # options is either one dict applied to every engine or one dict per engine
+        if options is None or isinstance(options, dict):
+            options = [options or {}] * workers
+        if len(options) != workers:
+            raise ValueError(f"Expected {workers} option sets, got {len(options)}")
+        self.engine_path = engine_path
+        self.workers = workers
+        self.engines = []
+        self.idle = queue.Queue()
+        try:
+            for engine_options in options:
+                engine = EngineSession(engine_path, engine_options, warm_up, hash_scope)
+                self.engines.append(engine)
+                self.idle.put(engine)
+        except Exception:
+            self.close()
+            raise
+        # The engines search in their own processes, so one thread per engine is enough
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+
+    def _run(self, func, args):
+        # Borrow an idle engine for the duration of one job
+        engine = self.idle.get()
+        try:
+            return func(engine, *args)
+        finally:
+            self.idle.put(engine)
+
+    # Schedule func(engine, *args) on the next idle engine and return a Future
+    def submit(self, func, *args):
+        return self.executor.submit(self._run, func, args)
+
+    # Run func(engine, item) for every item and yield the results in input order; items are taken from the
+    # iterable as results are consumed, so at most window jobs (default four per engine) are in flight at a time
+    def map(self, func, items, window=None):
+        window = window or 4 * self.workers
+        futures = collections.deque()
+        for item in items:
+            futures.append(self.submit(func, item))
+            if len(futures) >= window:
+                yield futures.popleft().result()
+        while futures:
+            yield futures.popleft().result()
+
+    # Analyse a single position on the next idle engine and return a Future
+    def analyse(self, board, limit):
+        return self.submit(lambda engine, position: engine.analyse(position, limit), board.copy())
+
+    # Number of times an engine of the pool crashed and was restarted
+    def restarts(self):
+        return sum(engine.restarts for engine in self.engines)
+
+    # Number of searches answered by the engines of the pool
+    def searches(self):
+        return sum(engine.searches for engine in self.engines)
+
+    def close(self):
+        if hasattr(self, 'executor'):
+            self.executor.shutdown(wait=True)
+        for engine in self.engines:
+            engine.quit()
+        self.engines = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
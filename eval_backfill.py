@@ -0,0 +1,190 @@
+"""Fill in the missing %eval comments of the PGN files in a directory tree.
+
+Eval-only scoring needs an %eval after every move. This backfill makes large
+archives with a few gaps usable on that fast path without a full engine
+re-analysis. It works in three passes:
+
+1. Collect: the comments of every game are tokenised as check_evals does.
+   Only games with a gap are parsed, and each position after a move without
+   an eval is collected once, keyed by its Zobrist hash. The files are
+   scanned in parallel worker processes.
+2. Analyse: the unique positions are searched in one batch on an EnginePool,
+   through the shared evaluation cache. Finished games (mate, stalemate) need
+   no engine: they get +-100.00 or 0.00.
+3. Write: every file is written to the output directory under the same
+   relative path. Games without gaps are copied byte for byte, and games with
+   gaps are written with their new evals in the encoding they were read in:
+   UTF-8, or Latin-1 for a game that is not valid UTF-8, so that the bytes of
+   names and comments are kept as they were."""
+
+# Import the necessary libraries
+import collections
+import functools
+import io
+import mmap
+import os
+from concurrent.futures import ProcessPoolExecutor
+import chess
+import chess.engine
+import chess.pgn
+import chess.polyglot
+import check_evals
+import eval_cache
+from engine_pool import EnginePool
+import pgn_shards
+import pgn_split
+
+
+# Function to get the byte ranges of the games of a memory-mapped PGN file
+def game_ranges(data):
+    offsets = pgn_shards.find_game_offsets_in(data)
+    if not offsets or offsets[0] != 0:
+        offsets = [0] + offsets
+    return zip(offsets, offsets[1:] + [len(data)])
+
+
+# Function to decode the bytes of a game as UTF-8 or, if they are not valid UTF-8, as Latin-1, which maps
+# every byte to one character, and return the text and the encoding that gives the same bytes back
+def decode_game(raw):
+    try:
+        return raw.decode('utf-8'), 'utf-8'
+    except UnicodeDecodeError:
+        return raw.decode('latin-1'), 'latin-1'
+
+
+# Function to yield the games of a PGN file that miss an eval as (start, end, game, encoding), parsing only those games
+def games_with_gaps(path):
+    if os.path.getsize(path) == 0:
+        return
+    with open(path, 'rb') as pgn, mmap.mmap(pgn.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        for start, end in game_ranges(data):
+            movetext = data[pgn_split.header_end(data, start, end):end].decode('utf-8', errors='replace')
+            if check_evals.eval_coverage(movetext, stop_at_first_gap=True)[2] is None:
+                continue
+            text, encoding = decode_game(data[start:end])
+            yield start, end, chess.pgn.read_game(io.StringIO(text)), encoding
+
+
+# Function to yield (node, board) for every mainline node after a move that has no %eval comment
+def nodes_without_eval(game):
+    board = game.board()
+    for node in game.mainline():
+        board.push(node.move)
+        if node.eval() is None:
+            yield node, board
+
+
+# Function to collect the positions without an eval in one file, as {zobrist hash: FEN}
+def collect_file(path):
+    positions = {}
+    games = 0
+    for start, end, game, encoding in games_with_gaps(path):
+        games += 1
+        for node, board in nodes_without_eval(game):
+            positions.setdefault(chess.polyglot.zobrist_hash(board), board.fen())
+    return games, positions
+
+
+# Function to get the score of a finished game, or None if the game goes on
+def game_over_score(board):
+    outcome = board.outcome()
+    if outcome is None:
+        return None
+    # The side to move has been mated, or the game is drawn
+    return chess.engine.PovScore(chess.engine.Cp(-10000 if outcome.winner is not None else 0), board.turn)
+
+
+# Function to search every position on the engine pool and return {zobrist hash: score}
+def analyse_positions(pool, positions, limit, cache=None):
+    scores = {}
+    # Keys of the positions handed to the pool, in order; the results come back in the same order
+    keys = collections.deque()
+
+    def boards():
+        for key, fen in positions.items():
+            board = chess.Board(fen)
+            score = game_over_score(board)
+            if score is not None:
+                scores[key] = score
+                continue
+            keys.append(key)
+            yield board
+
+    # Positions in the cache are not searched again, and only a few positions per engine are in flight at a time
+    for info in pool.map(functools.partial(eval_cache.analyse, limit=limit, cache=cache), boards()):
+        scores[keys.popleft()] = info['score']
+    return scores
+
+
+# Function to copy one PGN file with the missing evals filled in
+def write_file(path, output_path, scores):
+    written = 0
+    os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+    gaps = {start: (game, encoding) for start, end, game, encoding in games_with_gaps(path)}
+    with open(output_path, 'wb') as output_file:
+        if not gaps:
+            # Nothing to fill in: the file is copied as it is
+            with open(path, 'rb') as pgn:
+                while chunk := pgn.read(1 << 20):
+                    output_file.write(chunk)
+            return written
+        with open(path, 'rb') as pgn, mmap.mmap(pgn.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            for start, end in game_ranges(data):
+                if start not in gaps:
+                    output_file.write(data[start:end])
+                    continue
+                game, encoding = gaps[start]
+                for node, board in nodes_without_eval(game):
+                    node.set_eval(scores[chess.polyglot.zobrist_hash(board)])
+                    written += 1
+                output_file.write(f"{game}\n\n".encode(encoding))
+    return written
+
+
+# Function to fill in the missing evals of every PGN file under input_directory and write the files to output_directory
+def backfill_directory(input_directory, output_directory, engine_path, limit, workers=1, engine_options=None, cache=None):
+    files = list(check_evals.find_pgn_files(input_directory))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # Collect and deduplicate the positions of every file
+        positions = {}
+        file_keys = []
+        games = 0
+        for file_games, file_positions in executor.map(collect_file, files):
+            games += file_games
+            positions.update(file_positions)
+            file_keys.append(list(file_positions))
+        print(f"{len(files)} files, {games} games with missing evals, {len(positions)} unique positions to analyse")
+
+        # Search them all in one batch
+        scores = {}
+        if positions:
+            with EnginePool(engine_path, workers, engine_options, hash_scope='batch') as pool:
+                scores = analyse_positions(pool, positions, limit, cache)
+
+        # Write the files back out, sending each worker the scores of its file only
+        output_paths = [os.path.join(output_directory, os.path.relpath(path, input_directory)) for path in files]
+        file_scores = [{key: scores[key] for key in keys} for keys in file_keys]
+        written = sum(executor.map(write_file, files, output_paths, file_scores))
+    print(f"{written} evals written to {output_directory}")
+    return written
+
+
+# Main function
+def main(input_directory='input_folder_path', output_directory='output_folder_path', engine_path='engine_path_goes_here',
+         # Engine limits t for time and n for nodes
+         t=0.5, n=None,
+         # Number of engine and worker processes and the options sent to each engine
+         workers=1, engine_options=None,
+         # Evaluation cache shared with calculate_GI (default eval_cache.sqlite in the output directory)
+         cache_file=None):
+    if cache_file is None:
+        cache_file = os.path.join(output_directory, 'eval_cache.sqlite')
+    os.makedirs(output_directory, exist_ok=True)
+    with eval_cache.EvalCache(cache_file) as cache:
+        backfill_directory(input_directory, output_directory, engine_path, chess.engine.Limit(time=t, nodes=n), workers, engine_options, cache)
+        print(cache.report())
+
+
+# Call the main function
+if __name__ == "__main__":
+    main()
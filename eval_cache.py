@@ -0,0 +1,153 @@
+"""On-disk cache of engine evaluations so that positions which repeat across
+games and runs (openings, re-runs of a finished event) are searched only once.
+
+Entries are keyed by the Zobrist hash of the position, the engine name and the
+search limit, stored in SQLite and evicted least recently used first. Searches
+that are not plain single-line searches, such as one restricted with
+root_moves or one line of a MultiPV search, add a description of the search
+to the limit part of the key so they never mix with plain entries."""
+
+# Import the necessary libraries
+import sqlite3
+import threading
+import chess.polyglot
+import chess.engine
+from chess.engine import Cp, Mate, MateGiven, Wdl
+
+
+# Function to turn a search limit into a stable part of the cache key
+def limit_key(limit):
+    return f"time={limit.time},nodes={limit.nodes},depth={limit.depth},mate={limit.mate}"
+
+
+# Function to describe a search restricted to some root moves for the cache key
+def root_moves_key(root_moves):
+    return "root_moves=" + " ".join(sorted(move.uci() for move in root_moves))
+
+
+# Function to get the name an engine reported over UCI
+def engine_key(engine):
+    return engine.id.get('name', 'unknown')
+
+
+class EvalCache:
+    def __init__(self, path, max_entries=1000000, commit_every=100):
+        self.max_entries = max_entries
+        self.commit_every = commit_every
+        self.hits = 0
+        self.misses = 0
+        self.pending = 0
+        # The cache is shared by the threads of an engine pool
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS evals ("
+            "position TEXT, engine TEXT, search_limit TEXT, "
+            "kind TEXT, value INTEGER, wins INTEGER, draws INTEGER, losses INTEGER, "
+            "last_used INTEGER, "
+            "PRIMARY KEY (position, engine, search_limit))")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS evals_last_used ON evals (last_used)")
+        self.size, self.clock = self.connection.execute(
+            "SELECT COUNT(*), COALESCE(MAX(last_used), 0) FROM evals").fetchone()
+
+    def _key(self, board, engine_name, limit, search=''):
+        search_limit = limit_key(limit) + (f",{search}" if search else '')
+        return f"{chess.polyglot.zobrist_hash(board):016x}", engine_name, search_limit
+
+    def _maybe_commit(self):
+        self.pending += 1
+        if self.pending >= self.commit_every:
+            self.connection.commit()
+            self.pending = 0
+
+    # Return the cached analysis of a position, or None if it was never searched
+    def get(self, board, engine_name, limit, search=''):
+        key = self._key(board, engine_name, limit, search)
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT kind, value, wins, draws, losses FROM evals "
+                "WHERE position = ? AND engine = ? AND search_limit = ?", key).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            # Mark the entry as recently used
+            self.clock += 1
+            self.connection.execute(
+                "UPDATE evals SET last_used = ? WHERE position = ? AND engine = ? AND search_limit = ?",
+                (self.clock,) + key)
+            self._maybe_commit()
+
+        kind, value, wins, draws, losses = row
+        if kind == 'cp':
+            score = Cp(value)
+        elif kind == 'mate':
+            score = Mate(value)
+        else:
+            score = MateGiven
+        info = {'score': chess.engine.PovScore(score, board.turn)}
+        if wins is not None:
+            info['wdl'] = chess.engine.PovWdl(Wdl(wins, draws, losses), board.turn)
+        return info
+
+    # Store the analysis of a position, evicting the least recently used entries if full
+    def put(self, board, engine_name, limit, info, search=''):
+        score = info['score'].relative
+        if score == MateGiven:
+            kind, value = 'mate_given', 0
+        elif score.is_mate():
+            kind, value = 'mate', score.mate()
+        else:
+            kind, value = 'cp', score.score()
+        wins = draws = losses = None
+        if 'wdl' in info:
+            wins, draws, losses = info['wdl'].relative
+        key = self._key(board, engine_name, limit, search)
+        with self.lock:
+            self.clock += 1
+            # Another engine may have stored the same position in the meantime
+            inserted = self.connection.execute(
+                "INSERT OR IGNORE INTO evals VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                key + (kind, value, wins, draws, losses, self.clock)).rowcount
+            self.size += inserted
+            if self.size > self.max_entries:
+                self.connection.execute(
+                    "DELETE FROM evals WHERE rowid IN (SELECT rowid FROM evals ORDER BY last_used LIMIT ?)",
+                    (self.size - self.max_entries,))
+                self.size = self.max_entries
+            self._maybe_commit()
+
+    # Look a position up in the cache and only ask the engine on a miss
+    def analyse(self, engine, board, limit, root_moves=None):
+        engine_name = engine_key(engine)
+        search = root_moves_key(root_moves) if root_moves else ''
+        info = self.get(board, engine_name, limit, search)
+        if info is None:
+            info = engine.analyse(board, limit, root_moves=root_moves) if root_moves else engine.analyse(board, limit)
+            self.put(board, engine_name, limit, info, search)
+        return info
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def report(self):
+        return f"Eval cache: {self.hits} hits, {self.misses} misses ({self.hit_rate():.1%} hit rate), {self.size} entries"
+
+    def close(self):
+        with self.lock:
+            self.connection.commit()
+            self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+# Function to analyse a position through the cache when one is given, optionally restricted to some root moves
+def analyse(engine, board, limit, cache=None, root_moves=None):
+    if cache is None:
+        return engine.analyse(board, limit, root_moves=root_moves) if root_moves else engine.analyse(board, limit)
+    return cache.analyse(engine, board, limit, root_moves)
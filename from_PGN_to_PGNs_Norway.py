@@ -1,56 +1,25 @@
-"""This script is for Norway Chess games played in 2019 and later"""
-import chess.pgn
-import os
+"""This script is for Norway Chess games played in 2019 and later
 
-# Define the directory where your PGN file is located
-pgn_file = 'pgn_path_here'
+Rounds are numbered in pairs: the odd round of a pair is the classical game
+and the even round the armageddon game, which goes to a directory of its own.
+Games without a numeric Round are classical games named after their players."""
+import pgn_split
 
-# Define the directories where you want to write the new PGN files
-output_directory_classical = '/output_folder_path_here/NorwayChess{year}'
-output_directory_armageddon = '/output_folder_path_here/NorwayChess{year}armageddon'
+# Function to write each game of a Norway Chess PGN file to its own file, armageddon games in their own directory
+def split_pgn_file(pgn_path, output_directory_classical, output_directory_armageddon, router='norway', workers=1):
+    directories = {'classical': output_directory_classical, 'armageddon': output_directory_armageddon}
+    return pgn_split.split_pgn_file(pgn_path, directories, router, workers)
 
-# Create the directories if they don't exist
-os.makedirs(output_directory_classical, exist_ok=True)
-os.makedirs(output_directory_armageddon, exist_ok=True)
 
-# Open the multi-game PGN file
-with open(os.path.join(pgn_file)) as pgn_file:
-    while True:
-        # Read the next game from the PGN file
-        game = chess.pgn.read_game(pgn_file)
-        # print("Game:", game)
-        # If no game is read, then we're done
-        if game is None:
-            break
+if __name__ == "__main__":
+    # Define the directory where your PGN file is located
+    pgn_file = 'pgn_path_here'
 
-        # Check if 'Round' and 'Board' exist in game headers
-        round_str = game.headers.get('Round', '')
-        board_str = game.headers.get('Board', '')
+    # Define the directories where you want to write the new PGN files
+    output_directory_classical = '/output_folder_path_here/NorwayChess{year}'
+    output_directory_armageddon = '/output_folder_path_here/NorwayChess{year}armageddon'
 
-        # Check if the round and board are integers
-        if not round_str.isdigit() and not board_str.isdigit():
-            filename = f'game{game.headers["White"]}{game.headers["Black"]}.pgn'
-        elif not board_str.isdigit():
-            round = int(round_str)
-            # Update round number
-            round_updated = (round + 1) // 2
-            filename = f'gameR{round_updated}.pgn'
-        else:
-            round = int(round_str)
-            # Update round number
-            round_updated = (round + 1) // 2
-            board = int(board_str)
-            filename = f'gameR{round_updated}B{board}.pgn'
+    # Number of worker processes
+    workers = 1
 
-        # If 'UTCDate' exists in the headers, copy its value to 'Date'
-        if 'UTCDate' in game.headers:
-            game.headers['Date'] = game.headers['UTCDate']
-
-        # Determine the output directory based on whether the round is odd or even
-        output_directory = output_directory_armageddon if round % 2 == 0 else output_directory_classical
-
-
-        # Write the game to a new PGN file in the appropriate directory
-        with open(os.path.join(output_directory, filename), 'w') as output_file:
-            exporter = chess.pgn.FileExporter(output_file)
-            game.accept(exporter)
+    split_pgn_file(pgn_file, output_directory_classical, output_directory_armageddon, workers=workers)
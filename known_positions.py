@@ -0,0 +1,137 @@
+"""WDL of positions that need no engine search.
+
+Endgames with few enough pieces are probed in local Syzygy tablebases and
+give an exact result. Opening positions are looked up in a table of known
+engine scores keyed by Zobrist hash. The table is built once by walking a
+Polyglot book and searching every book position deeply. It keeps the scores
+rather than WDL, so one table serves every WDL model. Only the positions left
+over go to the engine."""
+
+# Import the necessary libraries
+import json
+import os
+import threading
+import chess
+import chess.engine
+import chess.polyglot
+import chess.syzygy
+from chess.engine import Wdl
+import eval_cache
+import wdl_models
+
+
+# Function to get the exact WDL of a position from the tablebases, or None if it is not covered
+def tablebase_wdl(tablebase, board, max_pieces=7):
+    if chess.popcount(board.occupied) > max_pieces:
+        return None
+    # Tables do not cover positions with castling rights, and missing tables give None
+    wdl = tablebase.get_wdl(board)
+    if wdl is None:
+        return None
+    # A win that cannot be forced before the fifty-move rule is a cursed win
+    if wdl in (2, -2):
+        dtz = tablebase.get_dtz(board)
+        if dtz is not None and abs(dtz) + board.halfmove_clock > 100:
+            wdl //= 2
+    # Cursed wins and blessed losses are draws under the fifty-move rule
+    if wdl == 2:
+        return chess.engine.PovWdl(Wdl(1000, 0, 0), board.turn)
+    if wdl == -2:
+        return chess.engine.PovWdl(Wdl(0, 0, 1000), board.turn)
+    return chess.engine.PovWdl(Wdl(0, 1000, 0), board.turn)
+
+
+# Function to load a table of opening positions {zobrist hex: centipawns for the side to move, mates as in wdl_models.score_cp}
+def load_opening_table(path):
+    with open(path) as table_file:
+        table = json.load(table_file)
+    for position, score in table.items():
+        if not isinstance(score, int):
+            raise ValueError(f"{path} holds WDL of one model instead of engine scores; rebuild it with build_opening_table")
+    return table
+
+
+# Function to search every position of a Polyglot book up to max_plies deep and save their scores as an opening table
+def build_opening_table(book_path, engine, limit, path, max_plies=16, cache=None):
+    table = {}
+    with chess.polyglot.open_reader(book_path) as book:
+        boards = [chess.Board()]
+        for ply in range(max_plies + 1):
+            next_boards = []
+            for board in boards:
+                position = f"{chess.polyglot.zobrist_hash(board):016x}"
+                # Transpositions are searched once
+                if position in table:
+                    continue
+                info = eval_cache.analyse(engine, board, limit, cache)
+                table[position] = wdl_models.score_cp(info['score'].relative)
+                if ply < max_plies:
+                    for entry in book.find_all(board):
+                        next_board = board.copy(stack=False)
+                        next_board.push(entry.move)
+                        next_boards.append(next_board)
+            boards = next_boards
+    # Write the table atomically so a crash never leaves half a table
+    temporary_path = path + '.tmp'
+    with open(temporary_path, 'w') as table_file:
+        json.dump(table, table_file)
+    os.replace(temporary_path, path)
+    return table
+
+
+class KnownPositions:
+    def __init__(self, syzygy_path=None, opening_table=None, max_pieces=7, wdl_model=None):
+        self.max_pieces = max_pieces
+        # Turns the scores of the opening table into WDL, as for the positions the engine searches
+        self.model = wdl_models.get_model(wdl_model)
+        self.tablebase = chess.syzygy.open_tablebase(syzygy_path) if syzygy_path else None
+        self.openings = load_opening_table(opening_table) if opening_table else {}
+        self.book_hits = 0
+        self.tablebase_hits = 0
+        self.lookups = 0
+        # Lookups come from the threads of an engine pool
+        self.lock = threading.Lock()
+
+    # Return the known WDL of a position from the side to move's point of view, or None
+    def lookup(self, board):
+        win_draw_loss = None
+        source = None
+        if self.openings:
+            score = self.openings.get(f"{chess.polyglot.zobrist_hash(board):016x}")
+            if score is not None:
+                win_draw_loss = chess.engine.PovWdl(self.model.wdl(score), board.turn)
+                source = 'book'
+        if win_draw_loss is None and self.tablebase is not None:
+            # The tablebase keeps open file handles that are not safe to share between threads
+            with self.lock:
+                win_draw_loss = tablebase_wdl(self.tablebase, board, self.max_pieces)
+            if win_draw_loss is not None:
+                source = 'tablebase'
+        with self.lock:
+            self.lookups += 1
+            if source == 'book':
+                self.book_hits += 1
+            elif source == 'tablebase':
+                self.tablebase_hits += 1
+        return win_draw_loss
+
+    def report(self):
+        return f"Known positions: {self.book_hits} opening and {self.tablebase_hits} tablebase hits out of {self.lookups} positions"
+
+    def close(self):
+        if self.tablebase is not None:
+            self.tablebase.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+# Function to get the WDL of a position, searching it only if it is not a known position
+def analyse_wdl(engine, board, limit, cache=None, known=None, wdl_model=None):
+    win_draw_loss = known.lookup(board) if known else None
+    if win_draw_loss is None:
+        win_draw_loss = wdl_models.get_model(wdl_model).pov_wdl(eval_cache.analyse(engine, board, limit, cache)['score'])
+    return win_draw_loss
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""Deterministic stand-in UCI engine for benchmarks, tests and profiling.
+
+It speaks enough UCI over stdin/stdout for python-chess and answers every
+search with a one-ply search whose leaves are scored from the material
+balance and a hash of the position, so the engine-driven scripts give the
+same results on every machine and can be profiled at thousands of positions
+per second without a real engine. With UCI_ShowWDL it also reports a WDL derived from the score,
+it honours MultiPV and searchmoves, and a configurable latency stands in for
+search time.
+
+Usage: python mock_engine.py [--latency SECONDS]
+
+The latency can also be set per engine with the Latency option (milliseconds),
+e.g. engine_options = {"Latency": 50}."""
+
+# Import the necessary libraries
+import argparse
+import sys
+import time
+import chess
+import chess.engine
+
+# Odd 64-bit multipliers that mix the bitboards of a position into a hash
+MIXERS = (0x9E3779B97F4A7C15, 0xC2B2AE3D27D4EB4F, 0x165667B19E3779F9, 0x27D4EB2F165667C5)
+
+
+# Function to get the centipawn score of a position for the side to move
+def position_score(board):
+    white, black = board.occupied_co[chess.WHITE], board.occupied_co[chess.BLACK]
+    minors = board.knights | board.bishops
+    material = (100 * (chess.popcount(board.pawns & white) - chess.popcount(board.pawns & black))
+                + 300 * (chess.popcount(minors & white) - chess.popcount(minors & black))
+                + 500 * (chess.popcount(board.rooks & white) - chess.popcount(board.rooks & black))
+                + 900 * (chess.popcount(board.queens & white) - chess.popcount(board.queens & black)))
+    # A hash of the position adds up to 50 centipawns either way so that quiet moves still differ
+    key = (white * MIXERS[0]) ^ (board.pawns * MIXERS[1]) ^ ((board.knights | board.rooks) * MIXERS[2]) ^ ((board.bishops | board.queens) * MIXERS[3]) ^ board.turn
+    score = material + (key >> 29) % 101 - 50
+    return score if board.turn == chess.WHITE else -score
+
+
+# Function to get the UCI score and WDL of a position for the side to move
+def score_and_wdl(score):
+    wdl = chess.engine.Cp(score).wdl()
+    return f'cp {score}', f'{wdl.wins} {wdl.draws} {wdl.losses}'
+
+
+class MockEngine:
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.multipv = 1
+        self.show_wdl = False
+        self.board = chess.Board()
+        self.position = []
+
+    # Set up the board from a UCI position command, pushing only the new moves when the game continues
+    def set_position(self, tokens):
+        if tokens[:len(self.position)] == self.position and self.position:
+            new_moves = tokens[len(self.position):]
+            if new_moves[:1] == ['moves']:
+                new_moves = new_moves[1:]
+        else:
+            if tokens[0] == 'startpos':
+                self.board = chess.Board()
+                rest = tokens[1:]
+            else:
+                end = tokens.index('moves') if 'moves' in tokens else len(tokens)
+                self.board = chess.Board(' '.join(tokens[1:end]))
+                rest = tokens[end:]
+            new_moves = rest[1:] if rest[:1] == ['moves'] else []
+        for move in new_moves:
+            self.board.push_uci(move)
+        self.position = tokens if 'moves' in tokens else tokens + ['moves']
+
+    def set_option(self, tokens):
+        name = ' '.join(tokens[2:tokens.index('value')]) if 'value' in tokens else ' '.join(tokens[2:])
+        value = tokens[tokens.index('value') + 1] if 'value' in tokens else None
+        if name == 'MultiPV':
+            self.multipv = int(value)
+        elif name == 'UCI_ShowWDL':
+            self.show_wdl = value == 'true'
+        elif name == 'Latency':
+            self.latency = int(value) / 1000
+
+    # Answer a go command with one info line per line of play and the best move
+    def search(self, tokens):
+        if self.latency:
+            time.sleep(self.latency)
+        board = self.board
+        moves = list(board.legal_moves)
+        if 'searchmoves' in tokens:
+            allowed = set()
+            for token in tokens[tokens.index('searchmoves') + 1:]:
+                try:
+                    allowed.add(chess.Move.from_uci(token))
+                except ValueError:
+                    break
+            moves = [move for move in moves if move in allowed]
+        if not moves:
+            # Checkmate or stalemate: there is nothing to search
+            score = 'mate 0' if board.is_check() else 'cp 0'
+            return [f'info depth 0 score {score}', 'bestmove (none)']
+        # The score of a move is the negated score of the position it leads to
+        lines = []
+        for move in moves:
+            board.push(move)
+            lines.append((-position_score(board), move))
+            board.pop()
+        # Ties are broken by the move itself so that the order of the lines never depends on the move generator
+        lines.sort(key=lambda line: (-line[0], line[1].uci()))
+        output = []
+        for number, (score, move) in enumerate(lines[:self.multipv], start=1):
+            uci_score, wdl = score_and_wdl(score)
+            wdl_part = f' wdl {wdl}' if self.show_wdl else ''
+            output.append(f'info depth 1 seldepth 1 multipv {number} score {uci_score}{wdl_part} nodes {len(moves)} nps {len(moves)} pv {move.uci()}')
+        output.append(f'bestmove {lines[0][1].uci()}')
+        return output
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Deterministic stand-in UCI engine")
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds to wait before answering each search")
+    engine = MockEngine(parser.parse_args().latency)
+    for line in sys.stdin:
+        tokens = line.split()
+        if not tokens:
+            continue
+        command = tokens[0]
+        if command == 'uci':
+            print('id name MockEngine')
+            print('id author Performance-Metrics')
+            print('option name Threads type spin default 1 min 1 max 1024')
+            print('option name Hash type spin default 16 min 1 max 33554432')
+            print('option name MultiPV type spin default 1 min 1 max 500')
+            print('option name UCI_ShowWDL type check default false')
+            print(f'option name Latency type spin default {round(engine.latency * 1000)} min 0 max 60000')
+            print('uciok', flush=True)
+        elif command == 'isready':
+            print('readyok', flush=True)
+        elif command == 'setoption':
+            engine.set_option(tokens)
+        elif command == 'ucinewgame':
+            engine.position = []
+        elif command == 'position':
+            engine.set_position(tokens[1:])
+        elif command == 'go':
+            print('\n'.join(engine.search(tokens)), flush=True)
+        elif command == 'quit':
+            break
+
+
+# Call the main function
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,337 @@
+"""One command line for every script, so that batch runs need no edited constants.
+
+Usage: performance-metrics [--config FILE] COMMAND [options]
+
+Commands:
+    analyse      score PGN files with an engine (calculate_GI)
+    score        score PGN files from their %eval comments (calculate_GI_WO_engine)
+    check-evals  report how many moves have an %eval comment (check_evals)
+    backfill     fill in the missing %eval comments with an engine (eval_backfill)
+    split        write each game of a PGN file to its own file (from_PGN_to_PGNs, pgn_split)
+    convert      turn bracketless eval comments into a PGN python-chess reads (convertPGN)
+    aggregate    total and average GI and GPL per player (tournamentGI)
+    calibrate    fit a WDL model to the eval-annotated games of an Elo band (wdl_models)
+
+Options can also come from a JSON file, or a TOML file on Python 3.11+. Keys
+are the option names with underscores, e.g. scoring_system or engine_options.
+Top-level keys apply to every command that has the option, and a table named
+after a command applies to that command only. Flags given on the command line
+override the file, and values from the file are checked against the same
+choices as the flags. The commands name 1/0.5 scoring differently ("FIDE" for
+analyse, "Standard" for score), so a scoring system goes in a command's table:
+
+    workers = 8
+
+    [score]
+    scoring_system = "Standard"
+
+    [analyse]
+    folder = "games"
+    engine_path = "stockfish"
+    scoring_system = "FIDE"
+    t = 0.5
+    engine_options = {Threads = 1, Hash = 512}"""
+
+# Import the necessary libraries
+import argparse
+import importlib.machinery
+import importlib.util
+import inspect
+import json
+import os
+import sys
+try:
+    import tomllib
+except ImportError:
+    tomllib = None
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# Options with a fixed set of values, per command; flags and configuration files are both checked against them
+CHOICES = {
+    'analyse': {
+        'scoring_system': ['NorwayChess', 'FIDE'],
+        'hash_scope': ['game', 'event', 'batch'],
+        'backend': ['threads', 'asyncio'],
+        'results_format': ['parquet', 'csv'],
+    },
+    'score': {
+        'scoring_system': ['NorwayChess', 'Standard'],
+        'results_format': ['parquet', 'csv'],
+    },
+    'split': {
+        'router': ['round_board', 'norway', 'player'],
+    },
+}
+
+
+# Function to import a script that has no .py extension, such as tournamentGI
+def load_script(name):
+    loader = importlib.machinery.SourceFileLoader(name, os.path.join(ROOT, name))
+    module = importlib.util.module_from_spec(importlib.util.spec_from_loader(name, loader))
+    loader.exec_module(module)
+    return module
+
+
+# Function to read a JSON or TOML configuration file
+def load_config(path):
+    if path.endswith('.toml'):
+        if tomllib is None:
+            raise ValueError("TOML configuration files need Python 3.11 or later; use JSON instead")
+        with open(path, 'rb') as config_file:
+            return tomllib.load(config_file)
+    with open(path) as config_file:
+        return json.load(config_file)
+
+
+# Function to parse an engine option given as NAME=VALUE, with numbers and true/false converted
+def engine_option(text):
+    name, separator, value = text.partition('=')
+    if not separator:
+        raise argparse.ArgumentTypeError(f"expected NAME=VALUE, got {text!r}")
+    if value.lstrip('-').isdigit():
+        return name, int(value)
+    if value.lower() in ('true', 'false'):
+        return name, value.lower() == 'true'
+    return name, value
+
+
+# The other keyword arguments go to calculate_GI.main
+def run_analyse(folder, engine_path, results_format=None, engine_options=None, **options):
+    import calculate_GI
+    if results_format and options.get('results_file') is None:
+        options['results_file'] = os.path.join(folder, f'results.{results_format}')
+    # Engine options from the command line arrive as (name, value) pairs
+    if engine_options is not None:
+        engine_options = dict(engine_options)
+    calculate_GI.main(folder, engine_path, engine_options=engine_options, **options)
+
+
+# The other keyword arguments go to calculate_GI_WO_engine.main
+def run_score(folder, output_directory, results_format=None, **options):
+    import calculate_GI_WO_engine
+    if results_format and options.get('results_file') is None:
+        options['results_file'] = os.path.join(output_directory, f'results.{results_format}')
+    calculate_GI_WO_engine.main(folder, output_directory, **options)
+
+
+def run_check_evals(directory, workers=1, report_file=None, stop_at_first_gap=False, list_missing=False):
+    import check_evals
+    # The old output, one line per move without an eval
+    if list_missing:
+        check_evals.scan_directory_for_pgn_files(directory, workers)
+        return
+    files = check_evals.scan_coverage(directory, workers, stop_at_first_gap, report_file)
+    print(check_evals.coverage_summary(files))
+
+
+# The other keyword arguments go to eval_backfill.main
+def run_backfill(input_directory, output_directory, engine_path, engine_options=None, **options):
+    import eval_backfill
+    if engine_options is not None:
+        engine_options = dict(engine_options)
+    eval_backfill.main(input_directory, output_directory, engine_path, engine_options=engine_options, **options)
+
+
+def run_split(pgn_file, output_directory, armageddon_directory=None, router=None, workers=1):
+    # Norway Chess files have their armageddon games written to a directory of their own
+    if armageddon_directory:
+        import from_PGN_to_PGNs_Norway
+        files = from_PGN_to_PGNs_Norway.split_pgn_file(pgn_file, output_directory, armageddon_directory, router or 'norway', workers)
+    else:
+        import from_PGN_to_PGNs
+        files = from_PGN_to_PGNs.split_pgn_file(pgn_file, output_directory, router or 'round_board', workers)
+    print(f"{files} files written")
+
+
+def run_convert(input_pgn, output_pgn, bracket_comments=True, strip_variations=True, strip_nags=True, black_move_numbers=True):
+    import convertPGN
+    convertPGN.convert_pgn_file(input_pgn, output_pgn, bracket_comments, strip_variations, strip_nags, black_move_numbers)
+
+
+def run_aggregate(pgn_dir=None, results_path=None, output_file='tournamentGI.csv'):
+    load_script('tournamentGI').main(pgn_dir, results_path, output_file)
+
+
+def run_calibrate(pgn_files, output_file='calibrated_model.json', min_elo=None, max_elo=None, name=None):
+    import wdl_models
+    wdl_models.main(pgn_files, output_file, min_elo, max_elo, name)
+
+
+COMMANDS = {
+    'analyse': run_analyse,
+    'score': run_score,
+    'check-evals': run_check_evals,
+    'backfill': run_backfill,
+    'split': run_split,
+    'convert': run_convert,
+    'aggregate': run_aggregate,
+    'calibrate': run_calibrate,
+}
+
+# Scripts whose main function takes the keyword arguments a command does not use itself
+PASSED_THROUGH = {
+    'analyse': 'calculate_GI',
+    'score': 'calculate_GI_WO_engine',
+    'backfill': 'eval_backfill',
+}
+
+
+# Function to get the names of the options a command accepts
+def accepted_options(command):
+    names = {name for name, parameter in inspect.signature(COMMANDS[command]).parameters.items()
+             if parameter.kind != parameter.VAR_KEYWORD}
+    if command in PASSED_THROUGH:
+        names |= set(inspect.signature(importlib.import_module(PASSED_THROUGH[command]).main).parameters)
+    return names
+
+
+def add_wdl_model_argument(parser):
+    parser.add_argument('--wdl-model', dest='wdl_model', metavar='MODEL',
+                        help="sf (default), sf16.1, sf16, sf15.1, sf15, sf14, sf12, lichess, or the .json file of a calibrated model")
+
+
+def add_profile_arguments(parser):
+    parser.add_argument('--profile', action='store_true', help="print where the time went at the end (see profiling.py)")
+    parser.add_argument('--trace', dest='trace_file', metavar='FILE', help="also save a Chrome trace of the run")
+
+
+def build_parser():
+    # Options left out stay out of the namespace, so that they do not override the configuration file
+    parser = argparse.ArgumentParser(prog='performance-metrics', description="Game Intelligence (GI) and Game Point Loss (GPL) of chess games")
+    parser.add_argument('--config', metavar='FILE', help="JSON or TOML file of default options")
+    commands = parser.add_subparsers(dest='command', required=True, metavar='COMMAND')
+
+    analyse = commands.add_parser('analyse', argument_default=argparse.SUPPRESS, help="score PGN files with an engine")
+    analyse.add_argument('folder', nargs='?', help="folder of .pgn files; results are written next to them")
+    analyse.add_argument('--engine', dest='engine_path', metavar='PATH', help="UCI engine executable")
+    analyse.add_argument('-t', '--time', dest='t', type=float, metavar='SECONDS', help="seconds per position (default 2)")
+    analyse.add_argument('-n', '--nodes', dest='n', type=int, metavar='NODES', help="nodes per position")
+    analyse.add_argument('--scoring-system', dest='scoring_system', choices=CHOICES['analyse']['scoring_system'])
+    analyse.add_argument('-w', '--workers', type=int, help="number of engine processes")
+    analyse.add_argument('--engine-option', dest='engine_options', action='append', type=engine_option, metavar='NAME=VALUE',
+                         help="UCI option sent to every engine, may be repeated (default Threads=1 Hash=256)")
+    analyse.add_argument('--hash-scope', dest='hash_scope', choices=CHOICES['analyse']['hash_scope'])
+    analyse.add_argument('--backend', choices=CHOICES['analyse']['backend'])
+    analyse.add_argument('--adaptive', action='store_true', help="shallow search first, full budget near error thresholds")
+    analyse.add_argument('--shallow-nodes', dest='shallow_nodes', type=int)
+    analyse.add_argument('--adaptive-margin', dest='adaptive_margin', type=float)
+    analyse.add_argument('--multipv', type=int, help="score each move from one search with this many lines")
+    analyse.add_argument('--reference-file', dest='reference_file', metavar='PGN', help="compare adaptive with uniform analysis on these games first")
+    analyse.add_argument('--syzygy', dest='syzygy_path', metavar='DIR', help="Syzygy tablebase directory")
+    analyse.add_argument('--opening-table', dest='opening_table', metavar='FILE', help="table of known opening scores (see known_positions.build_opening_table)")
+    analyse.add_argument('--cache', dest='cache_file', metavar='FILE', help="evaluation cache (default eval_cache.sqlite in the folder)")
+    analyse.add_argument('--max-cache-entries', dest='max_cache_entries', type=int)
+    analyse.add_argument('--results', dest='results_file', metavar='FILE', help="per-game results file; .parquet or .csv")
+    analyse.add_argument('--format', dest='results_format', choices=CHOICES['analyse']['results_format'], help="format of the default results file")
+    add_wdl_model_argument(analyse)
+    add_profile_arguments(analyse)
+
+    score = commands.add_parser('score', argument_default=argparse.SUPPRESS, help="score PGN files from their %%eval comments")
+    score.add_argument('folder', nargs='?', help="folder of .pgn files")
+    score.add_argument('output_directory', nargs='?', help="where the .json files and results go")
+    score.add_argument('--scoring-system', dest='scoring_system', choices=CHOICES['score']['scoring_system'])
+    score.add_argument('-w', '--workers', type=int, help="number of worker processes")
+    score.add_argument('--results', dest='results_file', metavar='FILE', help="per-game results file; .parquet or .csv")
+    score.add_argument('--format', dest='results_format', choices=CHOICES['score']['results_format'], help="format of the default results file")
+    add_wdl_model_argument(score)
+    add_profile_arguments(score)
+
+    check_evals = commands.add_parser('check-evals', argument_default=argparse.SUPPRESS, help="report how many moves have an %%eval comment")
+    check_evals.add_argument('directory', nargs='?', help="directory searched recursively for .pgn files")
+    check_evals.add_argument('-w', '--workers', type=int, help="number of worker processes")
+    check_evals.add_argument('--report', dest='report_file', metavar='FILE', help="per-file and per-game coverage report, .json or .csv")
+    check_evals.add_argument('--stop-at-first-gap', dest='stop_at_first_gap', action='store_true', help="scan each game only up to its first missing eval")
+    check_evals.add_argument('--list-missing', dest='list_missing', action='store_true', help="print every move without an eval instead")
+
+    backfill = commands.add_parser('backfill', argument_default=argparse.SUPPRESS, help="fill in the missing %%eval comments with an engine")
+    backfill.add_argument('input_directory', nargs='?', help="directory searched recursively for .pgn files")
+    backfill.add_argument('output_directory', nargs='?', help="where the completed files go, under the same relative paths")
+    backfill.add_argument('--engine', dest='engine_path', metavar='PATH', help="UCI engine executable")
+    backfill.add_argument('-t', '--time', dest='t', type=float, metavar='SECONDS', help="seconds per position (default 0.5)")
+    backfill.add_argument('-n', '--nodes', dest='n', type=int, metavar='NODES', help="nodes per position")
+    backfill.add_argument('-w', '--workers', type=int, help="number of engine and worker processes")
+    backfill.add_argument('--engine-option', dest='engine_options', action='append', type=engine_option, metavar='NAME=VALUE',
+                          help="UCI option sent to every engine, may be repeated")
+    backfill.add_argument('--cache', dest='cache_file', metavar='FILE', help="evaluation cache (default eval_cache.sqlite in the output directory)")
+
+    split = commands.add_parser('split', argument_default=argparse.SUPPRESS, help="write each game of a PGN file to its own file")
+    split.add_argument('pgn_file', nargs='?')
+    split.add_argument('output_directory', nargs='?')
+    split.add_argument('--armageddon-directory', dest='armageddon_directory', metavar='DIR',
+                       help="Norway Chess files: write the armageddon games here")
+    split.add_argument('--router', choices=CHOICES['split']['router'],
+                       help="where each game goes (default round_board, or norway with --armageddon-directory)")
+    split.add_argument('-w', '--workers', type=int, help="number of worker processes")
+
+    convert = commands.add_parser('convert', argument_default=argparse.SUPPRESS, help="make a PGN file with bracketless eval comments readable")
+    convert.add_argument('input_pgn', nargs='?')
+    convert.add_argument('output_pgn', nargs='?')
+    convert.add_argument('--no-brackets', dest='bracket_comments', action='store_false', help="do not wrap comments in [ ]")
+    convert.add_argument('--keep-variations', dest='strip_variations', action='store_false', help="do not remove variations")
+    convert.add_argument('--keep-nags', dest='strip_nags', action='store_false', help="do not remove NAGs such as $1")
+    convert.add_argument('--keep-move-numbers', dest='black_move_numbers', action='store_false',
+                         help="do not turn the repeated move number of a black move into N...")
+
+    aggregate = commands.add_parser('aggregate', argument_default=argparse.SUPPRESS, help="total and average GI and GPL per player")
+    aggregate.add_argument('pgn_dir', nargs='?', help="directory searched recursively for scored .pgn files")
+    aggregate.add_argument('--results', dest='results_path', metavar='FILE', help="also aggregate a results store (.parquet, .arrow or .csv)")
+    aggregate.add_argument('-o', '--output', dest='output_file', metavar='FILE', help=".csv or .parquet, default tournamentGI.csv")
+
+    calibrate = commands.add_parser('calibrate', argument_default=argparse.SUPPRESS, help="fit a WDL model to the games of an Elo band")
+    calibrate.add_argument('pgn_files', nargs='*', metavar='PGN', help="eval-annotated .pgn files with results")
+    calibrate.add_argument('-o', '--output', dest='output_file', metavar='FILE', help="model file to pass as --wdl-model, default calibrated_model.json")
+    calibrate.add_argument('--min-elo', dest='min_elo', type=int, help="lowest rating of both players")
+    calibrate.add_argument('--max-elo', dest='max_elo', type=int, help="rating both players stay below")
+    calibrate.add_argument('--name', help="model name, default elo{min}-{max}")
+    return parser
+
+
+# Function to merge the configuration file and the command line into the arguments of a command
+def command_options(command, config, arguments):
+    accepted = accepted_options(command)
+    options = {}
+    # Top-level keys are shared by the commands; keys this command does not use are skipped
+    for key, value in config.items():
+        if key not in COMMANDS and key.replace('-', '_') in accepted:
+            options[key.replace('-', '_')] = value
+    # Keys in the command's own table must all be options of the command
+    for key, value in config.get(command, {}).items():
+        if key.replace('-', '_') not in accepted:
+            raise ValueError(f"unknown option {key!r} in the [{command}] table")
+        options[key.replace('-', '_')] = value
+    # Values from the file skip argparse, so they are checked here
+    for key, choices in CHOICES.get(command, {}).items():
+        if key in options and options[key] not in choices:
+            raise ValueError(f"{key} = {options[key]!r} is not valid for {command}, expected one of {', '.join(choices)}")
+    options.update(arguments)
+    return options
+
+
+# Main function
+def main(argv=None):
+    parser = build_parser()
+    arguments = vars(parser.parse_args(argv))
+    command = arguments.pop('command')
+    config_path = arguments.pop('config', None)
+    try:
+        config = load_config(config_path) if config_path else {}
+    except (OSError, ValueError) as error:
+        parser.error(f"cannot read {config_path}: {error}")
+    try:
+        options = command_options(command, config, arguments)
+    except ValueError as error:
+        parser.error(f"{config_path}: {error}")
+    # Every positional argument must be given on the command line or in the configuration file
+    parameters = inspect.signature(COMMANDS[command]).parameters
+    missing = [name for name, parameter in parameters.items() if parameter.default is parameter.empty
+               and parameter.kind == parameter.POSITIONAL_OR_KEYWORD and options.get(name) is None]
+    if missing:
+        parser.error(f"{command}: missing {', '.join(missing)}")
+    COMMANDS[command](**options)
+    return 0
+
+
+# Call the main function
+if __name__ == "__main__":
+    sys.exit(main())
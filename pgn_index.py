@@ -0,0 +1,114 @@
+"""Sidecar index of the games in a PGN file for random access and incremental
+re-processing.
+
+For every game the index holds its byte offset and length, a digest of its
+header section and a hash of its full text. It is built in one pass, stored
+next to the PGN file as <file>.idx.json and trusted only while the size and
+modification time of the PGN file are unchanged. Comparing the content hashes
+of an old and a new index tells which games of an appended or edited file are
+new or changed."""
+
+# Import the necessary libraries
+import hashlib
+import io
+import json
+import mmap
+import os
+import re
+import chess.pgn
+import pgn_shards
+
+INDEX_VERSION = 1
+
+# The header section of a game ends at its first blank line
+BLANK_LINE = re.compile(rb'\r?\n[ \t]*\r?\n')
+
+
+# Function to get the sidecar path of a PGN file
+def index_path(path):
+    return path + '.idx.json'
+
+
+# Function to build the index of a PGN file in one pass
+def build_index(path):
+    stat = os.stat(path)
+    games = []
+    offsets = pgn_shards.find_game_offsets(path)
+    if stat.st_size:
+        with open(path, 'rb') as pgn, mmap.mmap(pgn.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            # Text before the first game start is a game of its own unless it is only whitespace
+            if not offsets or data[:offsets[0]].strip():
+                offsets = [0] + offsets
+            else:
+                offsets[0] = 0
+            view = memoryview(data)
+            for start, end in zip(offsets, offsets[1:] + [stat.st_size]):
+                blank = BLANK_LINE.search(data, start, end)
+                header_end = blank.start() if blank else end
+                # Trailing blank lines are not part of the game's content
+                content_end = end
+                while content_end > start and data[content_end - 1] in b' \t\r\n':
+                    content_end -= 1
+                games.append([
+                    start,
+                    end - start,
+                    hashlib.sha1(view[start:header_end]).hexdigest(),
+                    hashlib.sha1(view[start:content_end]).hexdigest(),
+                ])
+            view.release()
+    return {
+        'version': INDEX_VERSION,
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'games': games,
+    }
+
+
+# Function to load the sidecar index, or None if it is missing or stale
+def load_index(path):
+    try:
+        with open(index_path(path)) as index_file:
+            index = json.load(index_file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    stat = os.stat(path)
+    if index.get('version') != INDEX_VERSION or index['size'] != stat.st_size or index['mtime_ns'] != stat.st_mtime_ns:
+        return None
+    return index
+
+
+# Function to write the sidecar index atomically
+def save_index(path, index):
+    temporary_path = index_path(path) + '.tmp'
+    with open(temporary_path, 'w') as index_file:
+        json.dump(index, index_file)
+    os.replace(temporary_path, index_path(path))
+
+
+# Function to get a valid index and the positions of the games that are new or changed since the last one
+def update_index(path):
+    old_index = load_index(path)
+    if old_index is not None:
+        return old_index, []
+    try:
+        with open(index_path(path)) as index_file:
+            old_hashes = {game[3] for game in json.load(index_file).get('games', [])}
+    except (FileNotFoundError, json.JSONDecodeError):
+        old_hashes = set()
+    index = build_index(path)
+    save_index(path, index)
+    changed = [number for number, game in enumerate(index['games']) if game[3] not in old_hashes]
+    return index, changed
+
+
+# Function to read the raw text of game number n (counting from 0)
+def read_game_text(path, index, n):
+    offset, length = index['games'][n][:2]
+    with open(path, 'rb') as pgn:
+        pgn.seek(offset)
+        return pgn.read(length).decode('utf-8', errors='replace')
+
+
+# Function to parse game number n without reading the games before it
+def read_game_at(path, index, n):
+    return chess.pgn.read_game(io.StringIO(read_game_text(path, index, n)))
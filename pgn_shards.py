@@ -0,0 +1,94 @@
+"""Split a large PGN file into byte ranges on game boundaries so that its games
+can be parsed and scored by several processes at once.
+
+Game boundaries are found with an mmap scan for header tag lines that follow a
+blank line or movetext rather than another header tag line, so that games
+without an Event tag are found as well, and shard results are always returned in file order so that merging them
+gives the same totals as a serial run."""
+
+# Import the necessary libraries
+import bisect
+import io
+import mmap
+import os
+import re
+
+# A header tag line at the start of a line that does not follow another header tag line starts a game
+TAG_LINE = re.compile(rb'[A-Za-z0-9][A-Za-z0-9_+#=:-]*[ \t]+"')
+GAME_START = re.compile(rb'\n(?<!\]\n)(?<!\]\r\n)\[' + TAG_LINE.pattern)
+
+
+# Function to find the byte offset of the first header tag line of every game
+def find_game_offsets(path):
+    offsets = []
+    with open(path, 'rb') as pgn:
+        if os.fstat(pgn.fileno()).st_size == 0:
+            return offsets
+        with mmap.mmap(pgn.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            offsets = find_game_offsets_in(data)
+    return offsets
+
+
+# Function to find the offsets of the header tag lines that start a game in data[start:end]
+def find_game_offsets_in(data, start=0, end=None):
+    end = len(data) if end is None else end
+    offsets = []
+    if start == 0 and data[:1] == b'[' and TAG_LINE.match(data, 1):
+        offsets.append(0)
+    # Start one byte early so that a game starting exactly at start is found
+    offsets.extend(match.start() + 1 for match in GAME_START.finditer(data, max(start - 1, 0), end))
+    return offsets
+
+
+# Function to cut a file into about `shards` byte ranges of similar size that start on game boundaries
+def make_shards(path, shards, offsets=None):
+    size = os.path.getsize(path)
+    if size == 0:
+        return []
+    if offsets is None:
+        offsets = find_game_offsets(path)
+    boundaries = [0]
+    for shard in range(1, shards):
+        # Start the next shard at the first game at or after the ideal cut
+        index = bisect.bisect_left(offsets, size * shard // shards)
+        if index < len(offsets) and offsets[index] > boundaries[-1]:
+            boundaries.append(offsets[index])
+    boundaries.append(size)
+    return list(zip(boundaries, boundaries[1:]))
+
+
+# Raw reader over the bytes start..end of a file, which reports the end of the file at end
+class ShardReader(io.RawIOBase):
+    def __init__(self, path, start, end):
+        self.file = open(path, 'rb', buffering=0)
+        self.file.seek(start)
+        self.remaining = end - start
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        size = min(len(buffer), self.remaining)
+        if size <= 0:
+            return 0
+        read = self.file.readinto(memoryview(buffer)[:size])
+        self.remaining -= read
+        return read
+
+    def close(self):
+        if not self.closed:
+            self.file.close()
+        super().close()
+
+
+# Function to open one byte range of a PGN file as a text stream, read a buffer at a time
+def read_shard(path, start, end):
+    # Lines end at '\n' only and are not translated, as in the file
+    return io.TextIOWrapper(io.BufferedReader(ShardReader(path, start, end)), encoding='utf-8', errors='replace', newline='\n')
+
+
+# Function to run func(path, start, end, *args) on every shard of a file and yield the results in file order
+def map_shards(executor, func, path, shards, *args):
+    futures = [executor.submit(func, path, start, end, *args) for start, end in make_shards(path, shards)]
+    for future in futures:
+        yield future.result()
@@ -0,0 +1,209 @@
+"""Split multi-game PGN files into one file per game without parsing the games.
+
+Game boundaries come from the mmap scan of pgn_shards and only the header
+section of each game is read. A router decides from the headers where a game
+goes and which headers change. The bytes of the game are then copied as they
+are; only the changed header lines are rewritten, and movetext is never parsed
+or re-serialised.
+
+Routing happens in two passes over worker processes. The first pass routes
+every shard of the file. When several games go to the same file, the last one
+in the file wins, as with the old one-game-at-a-time splitters. The second
+pass writes the files.
+
+A router is a function of the headers that returns (targets, header_updates).
+Each target is (directory key, relative file name) and the key is looked up in
+the output directories passed to split_pgn_file(). ROUTERS names the built-in
+routers so that worker processes can find them."""
+
+# Import the necessary libraries
+import codecs
+import mmap
+import os
+from concurrent.futures import ProcessPoolExecutor
+import pgn_index
+import pgn_shards
+import pgn_stream
+
+
+# Function to get the integer value of a header such as Round or Board, or None if it is not a number
+def header_number(headers, name):
+    value = headers.get(name, '')
+    return int(value) if value.isdigit() else None
+
+
+# Function to give every game the Date of its UTCDate header, if it has one
+def date_updates(headers):
+    return {'Date': headers['UTCDate']} if 'UTCDate' in headers and headers['UTCDate'] != headers.get('Date') else {}
+
+
+# Function to make a header value safe to use as a file or directory name
+def safe_name(value):
+    return value.replace(os.sep, '_').replace('/', '_')
+
+
+# Router of from_PGN_to_PGNs: gameR{round}B{board}.pgn with Round set to round.board, gameR{round}.pgn or game{White}{Black}.pgn
+def route_round_board(headers):
+    updates = date_updates(headers)
+    round_number, board_number = header_number(headers, 'Round'), header_number(headers, 'Board')
+    if round_number is not None and board_number is not None:
+        updates['Round'] = f'{round_number}.{board_number}'
+        filename = f'gameR{round_number}B{board_number}.pgn'
+    elif round_number is not None:
+        filename = f'gameR{round_number}.pgn'
+    else:
+        filename = safe_name(f"game{headers.get('White', 'unknown')}{headers.get('Black', 'unknown')}.pgn")
+    return [('classical', filename)], updates
+
+
+# Router of from_PGN_to_PGNs_Norway: rounds are numbered in pairs, the even round of a pair is the armageddon game
+def route_norway(headers):
+    round_number, board_number = header_number(headers, 'Round'), header_number(headers, 'Board')
+    if round_number is None:
+        # Without a round number the game cannot be an armageddon game
+        return [('classical', safe_name(f"game{headers.get('White', 'unknown')}{headers.get('Black', 'unknown')}.pgn"))], date_updates(headers)
+    directory = 'armageddon' if round_number % 2 == 0 else 'classical'
+    if board_number is None:
+        filename = f'gameR{(round_number + 1) // 2}.pgn'
+    else:
+        filename = f'gameR{(round_number + 1) // 2}B{board_number}.pgn'
+    return [(directory, filename)], date_updates(headers)
+
+
+# Router that writes each game into a directory per player, once for White and once for Black
+def route_player(headers):
+    white, black = headers.get('White', 'unknown'), headers.get('Black', 'unknown')
+    round_number, board_number = header_number(headers, 'Round'), header_number(headers, 'Board')
+    if round_number is None:
+        filename = safe_name(f'game{white}{black}.pgn')
+    elif board_number is None:
+        filename = f'gameR{round_number}.pgn'
+    else:
+        filename = f'gameR{round_number}B{board_number}.pgn'
+    return [('classical', os.path.join(safe_name(white), filename)), ('classical', os.path.join(safe_name(black), filename))], date_updates(headers)
+
+
+ROUTERS = {
+    'round_board': route_round_board,
+    'norway': route_norway,
+    'player': route_player,
+}
+
+
+# Function to find the end of the header section of the game starting at start
+def header_end(data, start, end):
+    blank = pgn_index.BLANK_LINE.search(data, start, end)
+    return blank.start() if blank else end
+
+
+# Function to get the encoding of a header section: UTF-8 or, if it is not valid UTF-8, Latin-1, which maps every byte
+# to one character, so that rewritten lines are written back in the encoding of the rest of the game
+def header_encoding(header_bytes):
+    try:
+        header_bytes.decode('utf-8')
+        return 'utf-8'
+    except UnicodeDecodeError:
+        return 'latin-1'
+
+
+# Function to read the headers of the game in data[start:end]
+def read_headers(data, start, end):
+    # Missing Seven Tag Roster headers are '?' as in chess.pgn.read_game
+    headers = dict(pgn_stream.SEVEN_TAG_ROSTER)
+    header_bytes = data[start:header_end(data, start, end)]
+    encoding = header_encoding(header_bytes)
+    for line in header_bytes.decode('utf-8-sig' if encoding == 'utf-8' else encoding).splitlines():
+        match = pgn_stream.HEADER_REGEX.match(line)
+        if match:
+            headers[match.group(1)] = match.group(2)
+    return headers
+
+
+# Function to route the games that start in one byte range, returning {(directory key, file name): (start, end)}
+def route_shard(path, start, end, router_name):
+    router = ROUTERS[router_name]
+    targets = {}
+    with open(path, 'rb') as pgn, mmap.mmap(pgn.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        offsets = pgn_shards.find_game_offsets_in(data, start, end)
+        if not offsets or offsets[0] != start:
+            offsets = [start] + offsets
+        for game_start, game_end in zip(offsets, offsets[1:] + [end]):
+            # Whitespace before the first game is not a game
+            if not data[game_start:game_end].strip():
+                continue
+            for target in router(read_headers(data, game_start, game_end))[0]:
+                targets[target] = (game_start, game_end)
+    return targets
+
+
+# Function to rewrite the header lines of a game that the router changes and add the headers it does not have yet;
+# every other byte is kept, and new lines get the encoding and line terminator of the game's own header lines
+def rewrite_headers(header_bytes, updates):
+    encoding = header_encoding(header_bytes)
+    lines = header_bytes.splitlines(keepends=True)
+    terminator = b'\n'
+    remaining = dict(updates)
+    for number, line in enumerate(lines):
+        content = line.rstrip(b'\r\n')
+        if content != line:
+            terminator = line[len(content):]
+        # A byte order mark before the first header line stays where it is
+        prefix = codecs.BOM_UTF8 if content.startswith(codecs.BOM_UTF8) else b''
+        match = pgn_stream.HEADER_REGEX.match(content[len(prefix):].decode(encoding))
+        if match and match.group(1) in remaining:
+            lines[number] = prefix + f'[{match.group(1)} "{remaining.pop(match.group(1))}"]'.encode(encoding) + line[len(content):]
+    lines.extend(terminator + f'[{name} "{value}"]'.encode(encoding) for name, value in remaining.items())
+    return b''.join(lines)
+
+
+# Function to write the games of a list of (output path, start, end) jobs
+def write_games(path, jobs, router_name):
+    router = ROUTERS[router_name]
+    with open(path, 'rb') as pgn, mmap.mmap(pgn.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        for output_path, start, end in jobs:
+            headers_end = header_end(data, start, end)
+            updates = router(read_headers(data, start, end))[1]
+            with open(output_path, 'wb') as output_file:
+                # Only the header section is rewritten, and only if a header changes
+                if updates:
+                    output_file.write(rewrite_headers(data[start:headers_end], updates))
+                    output_file.write(data[headers_end:end])
+                else:
+                    output_file.write(data[start:end])
+    return len(jobs)
+
+
+# Function to split a PGN file into one file per routing target and return the number of files written
+def split_pgn_file(path, output_directories, router_name='round_board', workers=1):
+    if router_name not in ROUTERS:
+        raise ValueError(f"Unknown router {router_name!r}, expected one of {', '.join(ROUTERS)}")
+    for directory in output_directories.values():
+        os.makedirs(directory, exist_ok=True)
+    if os.path.getsize(path) == 0:
+        return 0
+    shards = pgn_shards.make_shards(path, workers)
+    executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    try:
+        # First pass: route every shard; later games win over earlier games with the same target
+        if executor:
+            shard_targets = [future.result() for future in [executor.submit(route_shard, path, start, end, router_name) for start, end in shards]]
+        else:
+            shard_targets = [route_shard(path, start, end, router_name) for start, end in shards]
+        targets = {}
+        for routed in shard_targets:
+            targets.update(routed)
+
+        jobs = []
+        for (directory_key, filename), (start, end) in targets.items():
+            output_path = os.path.join(output_directories[directory_key], filename)
+            os.makedirs(os.path.dirname(output_path), exist_ok=True)
+            jobs.append((output_path, start, end))
+        # Second pass: copy the games, in file order, spread evenly over the workers
+        jobs.sort(key=lambda job: job[1])
+        if executor:
+            chunks = [jobs[number::workers] for number in range(workers)]
+            return sum(future.result() for future in [executor.submit(write_games, path, chunk, router_name) for chunk in chunks])
+        return write_games(path, jobs, router_name)
+    finally:
+        if executor:
+            executor.shutdown()
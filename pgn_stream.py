@@ -0,0 +1,154 @@
+"""Fast streaming reader for eval-annotated PGN files.
+
+Yields (headers, evals) for every game without building boards or game trees.
+evals[0] is the eval of the start position and evals[i] the eval after the
+i-th mainline move, in pawns from the point of view of the side to move, with
+mates as +-(MATE_PAWNS - moves) and None where the comment has no %eval. These
+are the values calculate_GI_WO_engine.extract_eval_from_node returns for the
+same nodes."""
+
+# Import the necessary libraries
+import re
+import chess
+import chess.pgn
+
+# Header line such as [White "Carlsen, Magnus"]
+HEADER_REGEX = re.compile(r'^\[([A-Za-z0-9_+#=:-]+)\s+"((?:[^"\\]|\\.)*)"\]\s*$')
+
+# Movetext tokens: comments, rest-of-line comments, variations, NAGs, move numbers, results and moves
+TOKEN_REGEX = re.compile(r"""
+    \{(?P<comment>[^}]*)\}?
+    |;[^\n]*
+    |(?P<open>\()
+    |(?P<close>\))
+    |\$\d+
+    |\d+\.+
+    |(?P<result>1-0|0-1|1/2-1/2|\*)(?=\s|$)
+    |(?P<move>[^\s{}();$]+)
+    """, re.VERBOSE)
+
+
+# Pawns that stand for a forced mate: mating in n moves is MATE_PAWNS - n and being mated in n moves is
+# -(MATE_PAWNS - n), far beyond any real eval, so the WDL models can tell mates from other evals
+MATE_PAWNS = 10000
+
+
+# Seven Tag Roster defaults, as filled in by chess.pgn.read_game
+SEVEN_TAG_ROSTER = {
+    "Event": "?",
+    "Site": "?",
+    "Date": "????.??.??",
+    "Round": "?",
+    "White": "?",
+    "Black": "?",
+    "Result": "*",
+}
+
+
+# Function to tell whether a game starts with White to move
+def white_starts(headers):
+    fen = headers.get('FEN')
+    if fen is None:
+        return True
+    fields = fen.split()
+    return len(fields) < 2 or fields[1] != 'b'
+
+
+# Function to get the pawns that stand for a mate in `moves` for the side to move; 0 or less means it is mated
+def mate_pawns(moves):
+    return MATE_PAWNS - moves if moves > 0 else -MATE_PAWNS - moves
+
+
+# Function to convert a %eval comment to pawns for the side to move, as extract_eval_from_node does
+def parse_eval(comment, turn):
+    match = chess.pgn.EVAL_REGEX.search(comment)
+    if not match:
+        return None
+    if match.group('mate'):
+        mate = int(match.group('mate'))
+        # Mate 0 means the side to move has been mated
+        if mate == 0:
+            return mate_pawns(0)
+        return mate_pawns(mate if turn == chess.WHITE else -mate)
+    cp = round(float(match.group('cp')) * 100)
+    cp = cp if turn == chess.WHITE else -cp
+    return cp / 100.0
+
+
+# Function to extract the mainline evals (and optionally the moves) of one game's movetext
+def parse_movetext(movetext, first_turn, keep_moves=False):
+    evals = [None]
+    moves = []
+    turn = first_turn
+    depth = 0
+    for token in TOKEN_REGEX.finditer(movetext):
+        if token.group('open'):
+            depth += 1
+        elif token.group('close'):
+            depth = max(0, depth - 1)
+        elif depth:
+            # Everything inside a variation is ignored
+            continue
+        elif token.group('comment') is not None:
+            # Only the first eval attached to a position counts
+            if evals[-1] is None:
+                evals[-1] = parse_eval(token.group('comment'), turn)
+        elif token.group('move'):
+            turn = not turn
+            evals.append(None)
+            if keep_moves:
+                moves.append(token.group('move'))
+    return evals, moves
+
+
+# Function to check that the mainline moves of a game are legal
+def check_moves(headers, moves):
+    board = chess.Board(headers['FEN']) if 'FEN' in headers else chess.Board()
+    for ply, san in enumerate(moves):
+        try:
+            board.push_san(san)
+        except ValueError as error:
+            raise ValueError(f"Illegal move {san!r} at ply {ply + 1} in game {headers.get('White')} - {headers.get('Black')}") from error
+
+
+# Function to split a PGN stream into (headers, movetext) pairs, one game at a time
+def read_raw_games(handle):
+    headers = dict(SEVEN_TAG_ROSTER)
+    movetext = []
+    in_headers = False
+    in_movetext = False
+    in_comment = False
+    for line in handle:
+        # A line starting with [ is a header unless it is inside a multi-line comment
+        if not in_comment and line.startswith('['):
+            match = HEADER_REGEX.match(line)
+            if match:
+                if in_movetext:
+                    yield headers, ''.join(movetext)
+                    headers, movetext, in_movetext = dict(SEVEN_TAG_ROSTER), [], False
+                headers[match.group(1)] = match.group(2)
+                in_headers = True
+                continue
+        # Lines starting with % are escaped and skipped
+        if not in_comment and line.startswith('%'):
+            continue
+        if not line.strip() and not in_comment:
+            continue
+        in_movetext = True
+        movetext.append(line)
+        # Comments do not nest, so the last brace on the line tells whether one is still open
+        opening, closing = line.rfind('{'), line.rfind('}')
+        if opening != closing:
+            in_comment = opening > closing
+    if in_headers or in_movetext:
+        yield headers, ''.join(movetext)
+
+
+# Function to read (headers, evals) for every game of a PGN stream
+def read_eval_games(handle, check_legality=False):
+    for headers, movetext in read_raw_games(handle):
+        evals, moves = parse_movetext(movetext, white_starts(headers), keep_moves=check_legality)
+        # Move legality checks need a board and are off by default
+        if check_legality:
+            check_moves(headers, moves)
+        yield headers, evals
@@ -0,0 +1,198 @@
+"""Opt-in timing of the hot paths of the scripts.
+
+Code marks its stages (PGN parsing, engine search, WDL conversion, writing)
+with `with profiling.stage(name):` and counts work with profiling.count().
+Nothing is recorded until enable() is called; while disabled, stage() hands
+back one shared no-op context manager, so the instrumentation costs a
+function call and an attribute check.
+
+When enabled, every stage collects its number of calls, wall time, CPU time
+of the calling thread and a latency histogram with power-of-two millisecond
+buckets. summary() gives a table with counters per second and any noted
+values such as cache hit rates. With enable(trace=True) every stage call is
+also kept as an event, and write_trace() saves the totals together with the
+events in the Chrome trace format, which can be opened in chrome://tracing or
+Perfetto; without it memory stays constant however long the run. Worker processes send their snapshot() back to
+the parent, which merge()s it."""
+
+# Import the necessary libraries
+import contextlib
+import json
+import math
+import os
+import threading
+import time
+
+# Shared no-op context manager handed out while profiling is disabled
+DISABLED = contextlib.nullcontext()
+
+
+class Profiler:
+    def __init__(self):
+        self.enabled = False
+        # Keep one event per stage call for a Chrome trace
+        self.trace = False
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        # name -> [calls, wall seconds, cpu seconds]
+        self.stages = {}
+        # name -> {bucket: calls}, where bucket b holds calls of at most 2**b milliseconds
+        self.histograms = {}
+        self.counters = {}
+        self.values = {}
+        self.events = []
+        self.start = time.perf_counter()
+
+    def add(self, name, start, wall, cpu):
+        bucket = max(0, math.ceil(math.log2(wall * 1000))) if wall > 0.001 else 0
+        with self.lock:
+            totals = self.stages.setdefault(name, [0, 0.0, 0.0])
+            totals[0] += 1
+            totals[1] += wall
+            totals[2] += cpu
+            histogram = self.histograms.setdefault(name, {})
+            histogram[bucket] = histogram.get(bucket, 0) + 1
+            if self.trace:
+                self.events.append({'name': name, 'ph': 'X', 'ts': round(start * 1e6), 'dur': round(wall * 1e6),
+                                    'pid': os.getpid(), 'tid': threading.get_ident()})
+
+
+class Stage:
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.wall = time.perf_counter()
+        self.cpu = time.thread_time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        PROFILER.add(self.name, self.wall, time.perf_counter() - self.wall, time.thread_time() - self.cpu)
+
+
+PROFILER = Profiler()
+
+
+# Function to start recording, discarding anything recorded before; trace keeps every stage call for write_trace()
+def enable(trace=False):
+    PROFILER.reset()
+    PROFILER.trace = trace
+    PROFILER.enabled = True
+
+
+def disable():
+    PROFILER.enabled = False
+
+
+def is_enabled():
+    return PROFILER.enabled
+
+
+# Function to time a block of code as one call of a stage
+def stage(name):
+    if not PROFILER.enabled:
+        return DISABLED
+    return Stage(name)
+
+
+# Function to time every step of an iterator, such as a PGN reader, as a call of a stage
+def timed_iter(name, iterable):
+    if not PROFILER.enabled:
+        return iterable
+    return _timed_iter(name, iterable)
+
+
+def _timed_iter(name, iterable):
+    iterator = iter(iterable)
+    while True:
+        with stage(name):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
+
+
+# Function to add to a counter such as positions or games
+def count(name, amount=1):
+    if PROFILER.enabled:
+        with PROFILER.lock:
+            PROFILER.counters[name] = PROFILER.counters.get(name, 0) + amount
+
+
+# Function to record a value such as a cache hit rate for the summary
+def note(name, value):
+    if PROFILER.enabled:
+        with PROFILER.lock:
+            PROFILER.values[name] = value
+
+
+# Function to get everything recorded so far, e.g. to send it from a worker process to its parent
+def snapshot():
+    with PROFILER.lock:
+        return {
+            'stages': {name: list(totals) for name, totals in PROFILER.stages.items()},
+            'histograms': {name: dict(histogram) for name, histogram in PROFILER.histograms.items()},
+            'counters': dict(PROFILER.counters),
+            'values': dict(PROFILER.values),
+            'events': list(PROFILER.events),
+        }
+
+
+# Function to add the snapshot of another process to this one
+def merge(other):
+    if not PROFILER.enabled or other is None:
+        return
+    with PROFILER.lock:
+        for name, (calls, wall, cpu) in other['stages'].items():
+            totals = PROFILER.stages.setdefault(name, [0, 0.0, 0.0])
+            totals[0] += calls
+            totals[1] += wall
+            totals[2] += cpu
+        for name, other_histogram in other['histograms'].items():
+            histogram = PROFILER.histograms.setdefault(name, {})
+            for bucket, calls in other_histogram.items():
+                histogram[int(bucket)] = histogram.get(int(bucket), 0) + calls
+        for name, amount in other['counters'].items():
+            PROFILER.counters[name] = PROFILER.counters.get(name, 0) + amount
+        PROFILER.values.update(other['values'])
+        PROFILER.events.extend(other['events'])
+
+
+# Function to format the recorded stages, counters and values as a table
+def summary():
+    elapsed = time.perf_counter() - PROFILER.start
+    lines = [f"Profile over {elapsed:.2f}s wall",
+             f"{'stage':<16}{'calls':>10}{'wall s':>11}{'cpu s':>11}{'mean ms':>10}  latency (calls at <= ms)"]
+    for name, (calls, wall, cpu) in sorted(PROFILER.stages.items(), key=lambda item: -item[1][1]):
+        histogram = ' '.join(f"{2 ** bucket}:{calls_in_bucket}" for bucket, calls_in_bucket in sorted(PROFILER.histograms[name].items()))
+        lines.append(f"{name:<16}{calls:>10}{wall:>11.3f}{cpu:>11.3f}{1000 * wall / calls:>10.3f}  {histogram}")
+    for name, amount in sorted(PROFILER.counters.items()):
+        lines.append(f"{name:<16}{amount:>10} ({amount / elapsed:.1f}/s)")
+    for name, value in sorted(PROFILER.values.items()):
+        lines.append(f"{name:<16}{value}")
+    return '\n'.join(lines)
+
+
+# Function to write the totals and the per-call events as a Chrome trace
+def write_trace(path):
+    data = snapshot()
+    trace = {
+        'traceEvents': data.pop('events'),
+        'displayTimeUnit': 'ms',
+        'otherData': data,
+    }
+    with open(path, 'w') as trace_file:
+        json.dump(trace, trace_file)
+
+
+# Function to print the summary and write the trace at the end of a run, if profiling is enabled
+def report(trace_path=None):
+    if not PROFILER.enabled:
+        return
+    print(summary())
+    if trace_path:
+        write_trace(trace_path)
+        print(f"Trace written to {trace_path}")
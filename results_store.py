@@ -0,0 +1,224 @@
+"""Columnar store of per-game, per-player results.
+
+Every scored game adds one record for White and one for Black with GI, GPL,
+AGPL, move count and blunder/mistake/inaccuracy counts. Records are written in
+batches to Parquet or Arrow IPC when pyarrow is installed and to CSV
+otherwise, so tournament statistics can be computed by streaming the store
+(see tournamentGI) instead of re-parsing PGN files.
+
+Records of engine runs also carry the content hash of their game from the
+sidecar index and a key of the run's settings, so that a later run with the
+same settings can take the results of unchanged games from the store instead
+of analysing them again."""
+
+# Import the necessary libraries
+import csv
+import hashlib
+import json
+import os
+
+# pyarrow is optional; without it the store is a CSV file
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pa = None
+
+# Column names and types of a result record
+FIELDS = [
+    ("source", "string"),
+    ("game", "int"),
+    ("event", "string"),
+    ("site", "string"),
+    ("date", "string"),
+    ("round", "string"),
+    ("player", "string"),
+    ("color", "string"),
+    ("opponent", "string"),
+    ("elo", "string"),
+    ("points", "float"),
+    ("gi", "float"),
+    ("gpl", "float"),
+    ("agpl", "float"),
+    ("moves", "int"),
+    ("blunders", "int"),
+    ("mistakes", "int"),
+    ("inaccuracies", "int"),
+    ("content_hash", "string"),
+    ("settings", "string"),
+]
+FIELD_NAMES = [name for name, kind in FIELDS]
+
+
+# Function to get the points of each player from a result, or None for unfinished games
+def result_points(result, scoring_system):
+    win, draw = (3, 1.25) if scoring_system == "NorwayChess" else (1, 0.5)
+    if result == '1-0':
+        return win, 0
+    if result == '0-1':
+        return 0, win
+    if result == '1/2-1/2':
+        return draw, draw
+    return None, None
+
+
+# Function to build the White and Black records of one game
+def make_game_records(source, game_number, headers, scoring_system, white_gi, black_gi, white_gpl, black_gpl, white_move_number, black_move_number, counts=None, content_hash=None, settings=None):
+    white_points, black_points = result_points(headers.get("Result"), scoring_system)
+    date = headers.get("UTCDate", headers.get("Date"))
+    records = []
+    for color, opponent_color, points, gi, gpl, moves in (
+            ("White", "Black", white_points, white_gi, white_gpl, white_move_number),
+            ("Black", "White", black_points, black_gi, black_gpl, black_move_number)):
+        side = color.lower()
+        records.append({
+            "source": source,
+            "game": game_number,
+            "event": headers.get("Event"),
+            "site": headers.get("Site"),
+            "date": date,
+            "round": headers.get("Round"),
+            "player": headers.get(color),
+            "color": color,
+            "opponent": headers.get(opponent_color),
+            "elo": headers.get(color + "Elo"),
+            "points": points,
+            "gi": gi,
+            "gpl": gpl,
+            "agpl": gpl / moves if moves else None,
+            "moves": moves,
+            "blunders": counts[side + "_blunder"] if counts else None,
+            "mistakes": counts[side + "_mistake"] if counts else None,
+            "inaccuracies": counts[side + "_inaccuracy"] if counts else None,
+            "content_hash": content_hash,
+            "settings": settings,
+        })
+    return records
+
+
+# Function to get the pyarrow schema of the records
+def arrow_schema():
+    types = {"string": pa.string(), "int": pa.int64(), "float": pa.float64()}
+    return pa.schema([(name, types[kind]) for name, kind in FIELDS])
+
+
+# Function to get the key of the settings a result was computed with
+def settings_key(settings):
+    return hashlib.sha1(json.dumps(settings, sort_keys=True).encode()).hexdigest()
+
+
+# Function to get the path a store is actually written to, which is a CSV file when pyarrow is not installed
+def store_path(path):
+    if pa is None and not path.endswith('.csv'):
+        return os.path.splitext(path)[0] + '.csv'
+    return path
+
+
+class ResultsWriter:
+    def __init__(self, path, batch_size=10000):
+        # The file is only opened by the first flush, so the results of the last run can be read until then
+        path = store_path(path)
+        self.path = path
+        self.batch_size = batch_size
+        self.batch = []
+        self.writer = None
+        self.handle = None
+        if path.endswith('.parquet'):
+            self.format = 'parquet'
+        elif path.endswith(('.arrow', '.feather')):
+            self.format = 'arrow'
+        else:
+            self.format = 'csv'
+
+    # Add records and write them out once a full batch is buffered
+    def write(self, records):
+        self.batch.extend(records)
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.batch:
+            return
+        if self.format == 'csv':
+            if self.handle is None:
+                self.handle = open(self.path, 'w', newline='')
+                self.writer = csv.DictWriter(self.handle, fieldnames=FIELD_NAMES)
+                self.writer.writeheader()
+            self.writer.writerows(self.batch)
+        else:
+            table = pa.Table.from_pylist(self.batch, schema=arrow_schema())
+            if self.writer is None:
+                if self.format == 'parquet':
+                    self.writer = pyarrow.parquet.ParquetWriter(self.path, arrow_schema())
+                else:
+                    self.writer = pyarrow.ipc.new_file(self.path, arrow_schema())
+            self.writer.write_table(table)
+        self.batch = []
+
+    def close(self):
+        self.flush()
+        if self.format == 'csv':
+            if self.handle is not None:
+                self.handle.close()
+        elif self.writer is not None:
+            self.writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+# Function to check that a store can be read with the installed libraries
+def check_readable(path):
+    if pa is None and not path.endswith('.csv'):
+        raise ImportError(f"pyarrow is needed to read {path}")
+
+
+# Function to read the records of a results store back, one batch at a time
+def read_results(path):
+    check_readable(path)
+    if path.endswith('.parquet'):
+        for batch in pyarrow.parquet.ParquetFile(path).iter_batches():
+            yield from batch.to_pylist()
+    elif path.endswith(('.arrow', '.feather')):
+        with pa.memory_map(path) as source:
+            reader = pyarrow.ipc.open_file(source)
+            for number in range(reader.num_record_batches):
+                yield from reader.get_batch(number).to_pylist()
+    else:
+        # A float column holds the ints the scorers return for a side without moves, written without a point
+        converters = {"string": str, "int": int, "float": lambda value: int(value) if value.lstrip('-').isdigit() else float(value)}
+        with open(path, newline='') as handle:
+            for row in csv.DictReader(handle):
+                # Stores written before a column was added read it as missing
+                yield {name: converters[kind](row[name]) if row.get(name) else None for name, kind in FIELDS}
+
+
+# Function to load the results of the games a previous run scored with the given settings key as
+# {(source, content hash): (game result, counts)}, in the form the scorers return them
+def load_game_results(path, settings):
+    path = store_path(path)
+    if not os.path.exists(path):
+        return {}
+    results = {}
+    white = None
+    # The White record of a game is always written just before its Black record
+    for record in read_results(path):
+        if record["color"] == "White":
+            white = record
+            continue
+        if white is None or record.get("settings") != settings or record.get("content_hash") is None:
+            continue
+        game_result = (white["gi"], record["gi"], white["gpl"], record["gpl"], white["moves"], record["moves"])
+        counts = {}
+        for side, side_record in (("white", white), ("black", record)):
+            counts[side + "_blunder"] = side_record["blunders"]
+            counts[side + "_mistake"] = side_record["mistakes"]
+            counts[side + "_inaccuracy"] = side_record["inaccuracies"]
+        results[(record["source"], record["content_hash"])] = (game_result, counts)
+        white = None
+    return results
+
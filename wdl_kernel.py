@@ -0,0 +1,87 @@
+"""Vectorized win/draw/loss and expected-score kernel for eval-annotated games.
+
+Takes the centipawn evals of a whole game and returns the per-ply win/draw/loss, expected scores, point losses and
+blunder/mistake/inaccuracy flags as NumPy arrays in one call. Evals are turned
+into WDL with the lookup tables of a wdl_models model, the python-chess default
+unless another is given, so the results match calculate_GI_WO_engine.calculate_gi
+with the same model."""
+
+# Import the necessary libraries
+import numpy as np
+import wdl_models
+
+# Centipawns used when a position has no %eval, as in calculate_GI_WO_engine
+DEFAULT_CP = 30
+
+# Point-loss thresholds for blunders, mistakes and inaccuracies
+BLUNDER = 0.7
+MISTAKE = 0.4
+INACCURACY = 0.2
+
+
+# Function to get the points for a win and a draw in a scoring system
+def scoring_points(scoring_system):
+    if scoring_system in ("Standard", "FIDE"):
+        return 1, 0.5
+    return 3, 1.25
+
+
+# Function to convert evals in pawns (mates as in pgn_stream, missing as None) to integer centipawns
+def evals_to_centipawns(evals):
+    pawns = np.array([DEFAULT_CP / 100 if value is None else value for value in evals], dtype=np.float64)
+    # Truncate towards zero like int(100*eval)
+    return np.trunc(100 * pawns).astype(np.int64)
+
+
+# Function to compute wins, draws and losses (per mille) for centipawn arrays
+def wdl(cp, ply=30, model=None):
+    return wdl_models.get_model(model).wdl_arrays(cp, ply)
+
+
+# Function to score every ply of a game in a single vectorized pass
+def score_plies(cp, white_to_move, scoring_system, ply=30, model=None):
+    # cp holds one entry per position, including the start position of the game, and
+    # white_to_move the side to move in each position.
+    # Per-ply entry i describes the move from position i-1 to position i.
+    cp = np.asarray(cp, dtype=np.int64)
+    white_to_move = np.asarray(white_to_move, dtype=bool)
+    win_points, draw_points = scoring_points(scoring_system)
+
+    wins, draws, losses = wdl(cp, ply, model)
+    win_prob, draw_prob, loss_prob = wins / 1000, draws / 1000, losses / 1000
+    # The eval is read from the side to move's point of view, as in calculate_expected_value
+    expected_white = np.where(white_to_move, win_prob, loss_prob) * win_points + draw_prob * draw_points
+    expected_black = np.where(white_to_move, loss_prob, win_prob) * win_points + draw_prob * draw_points
+
+    # A ply is the move from the previous position, made by the side to move there
+    is_move = np.ones(len(cp), dtype=bool)
+    is_move[:1] = False
+    white_moved = np.zeros(len(cp), dtype=bool)
+    white_moved[1:] = white_to_move[:-1]
+    point_loss = np.zeros(len(cp), dtype=np.float64)
+    point_loss[1:] = np.where(white_moved[1:],
+                              expected_white[:-1] - expected_white[1:],
+                              expected_black[:-1] - expected_black[1:])
+    point_loss[~is_move] = 0
+
+    return {
+        "wins": wins,
+        "draws": draws,
+        "losses": losses,
+        "expected_white": expected_white,
+        "expected_black": expected_black,
+        "is_move": is_move,
+        "white_moved": white_moved & is_move,
+        "point_loss": point_loss,
+        "blunder": is_move & (point_loss >= BLUNDER),
+        "mistake": is_move & (point_loss >= MISTAKE) & (point_loss < BLUNDER),
+        "inaccuracy": is_move & (point_loss >= INACCURACY) & (point_loss < MISTAKE),
+    }
+
+
+# Function to score one game given its evals and the side to move in the start position
+def score_game(evals, white_starts, scoring_system, ply=30, model=None):
+    cp = evals_to_centipawns(evals)
+    white_to_move = np.arange(len(cp)) % 2 == (0 if white_starts else 1)
+    return score_plies(cp, white_to_move, scoring_system, ply=ply, model=model)
+
@@ -0,0 +1,349 @@
+"""Win/draw/loss models that turn centipawn evals into WDL, shared by every script.
+
+A model maps an eval in centipawns, and the ply it was reached at, to wins,
+draws and losses per mille for the side the eval is for. The named models are
+the ones python-chess has for Cp.wdl():
+
+    sf        the default of Cp.wdl(), the latest Stockfish model (sf16.1)
+    sf16.1, sf16, sf15.1, sf15, sf14, sf12
+              the models of earlier Stockfish versions
+    lichess   the logistic curve of lichess accuracy; it has no draws
+
+A CalibratedModel has the same logistic form as the Stockfish models, with two
+fixed parameters fitted to the results of real games. Use calibrate_from_pgn()
+to fit one to the eval-annotated games of an Elo band and save it as JSON, then
+pass the path of the file wherever a model name is expected.
+
+Evals in centipawns at least MATE_THRESHOLD from zero are the mates of
+pgn_stream (100 * mate_pawns()); every model scores them as mates, with
+mate_wdl(), instead of as large evals.
+
+Each model keeps a lookup table per ply over -CP_LIMIT..CP_LIMIT centipawns,
+filled the first time the ply is used. Converting an eval is then two list
+lookups instead of two exp() calls, and wdl_arrays() converts a whole NumPy
+array of evals with one gather. Evals beyond the table are looked up at its
+ends: every python-chess model is flat there, and a calibrated model clamps
+its evals to the same range. Every model gives the same values as the
+python-chess function it is built on."""
+
+# Import the necessary libraries
+import json
+import math
+import os
+import threading
+from chess.engine import Cp, Mate, MateGiven, PovWdl, Wdl
+import pgn_stream
+# NumPy is optional; without it only the scalar lookups are available
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Centipawns covered by the lookup tables; no model changes beyond this
+CP_LIMIT = 2000
+
+# Every model treats plies outside 0..MAX_PLY like the nearest end of the range
+MAX_PLY = 240
+
+# Model used when none is given, the default of python-chess
+DEFAULT_MODEL = 'sf'
+
+# Centipawns of a mate given, and from how far from zero an eval in centipawns is a mate (see pgn_stream.mate_pawns)
+MATE_CP = 100 * pgn_stream.MATE_PAWNS
+MATE_THRESHOLD = MATE_CP // 2
+
+
+# Function to get the centipawns of a score for the side it is for, mates as in pgn_stream
+def score_cp(score):
+    if score == MateGiven:
+        return MATE_CP
+    if score.is_mate():
+        return 100 * pgn_stream.mate_pawns(score.mate())
+    return score.score()
+
+
+# Function to get the score that centipawns from score_cp() or pgn_stream stand for
+def cp_score(cp):
+    if cp >= MATE_THRESHOLD:
+        moves = (MATE_CP - cp) // 100
+        return Mate(moves) if moves else MateGiven
+    if cp <= -MATE_THRESHOLD:
+        return Mate(-((MATE_CP + cp) // 100))
+    return Cp(cp)
+
+
+class WdlModel:
+    """Base class: subclasses define compute_wdl(cp, ply) and mate_wdl(score, ply)."""
+
+    def __init__(self, name):
+        self.name = name
+        # {ply: (wins, losses)} lists indexed by cp + CP_LIMIT, and their NumPy copies
+        self.tables = {}
+        self.arrays = {}
+        self.lock = threading.Lock()
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.name!r})"
+
+    # String that tells this model apart from every model that gives other values, e.g. for checkpoints
+    def key(self):
+        return self.name
+
+    # Models are sent to worker processes without their tables, which are rebuilt there on first use
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state.update(tables={}, arrays={}, lock=None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def compute_wdl(self, cp, ply):
+        raise NotImplementedError
+
+    def mate_wdl(self, score, ply):
+        raise NotImplementedError
+
+    # Get the (wins, losses) table of a ply, building it on first use
+    def table(self, ply):
+        ply = min(max(ply, 0), MAX_PLY)
+        table = self.tables.get(ply)
+        if table is None:
+            with self.lock:
+                table = self.tables.get(ply)
+                if table is None:
+                    wdls = [self.compute_wdl(cp, ply) for cp in range(-CP_LIMIT, CP_LIMIT + 1)]
+                    table = ([wdl.wins for wdl in wdls], [wdl.losses for wdl in wdls])
+                    self.tables[ply] = table
+        return table
+
+    # Build the tables of the given plies ahead of time, e.g. before timing a run
+    def precompute(self, plies=range(MAX_PLY + 1)):
+        for ply in plies:
+            self.table(ply)
+        return self
+
+    # WDL for the side an eval in centipawns is for
+    def wdl(self, cp, ply=30):
+        if not -MATE_THRESHOLD < cp < MATE_THRESHOLD:
+            return self.mate_wdl(cp_score(cp), ply)
+        wins, losses = self.table(ply)
+        index = min(max(cp, -CP_LIMIT), CP_LIMIT) + CP_LIMIT
+        return Wdl(wins[index], 1000 - wins[index] - losses[index], losses[index])
+
+    # WDL of an engine score (Cp, Mate or MateGiven) for the side it is for
+    def score_wdl(self, score, ply=30):
+        if score.is_mate():
+            return self.mate_wdl(score, ply)
+        return self.wdl(score.score(), ply)
+
+    # PovWdl of a PovScore, the counterpart of PovScore.wdl()
+    def pov_wdl(self, pov_score, ply=30):
+        return PovWdl(self.score_wdl(pov_score.relative, ply), pov_score.turn)
+
+    # Wins, draws and losses per mille of NumPy arrays of centipawns, at one ply or at an array of plies
+    def wdl_arrays(self, cp, ply=30):
+        cp = np.asarray(cp, dtype=np.int64)
+        index = np.clip(cp, -CP_LIMIT, CP_LIMIT)
+        index += CP_LIMIT
+        if np.ndim(ply) == 0:
+            table_wins, table_losses = self.ply_arrays(int(ply))
+            wins, losses = table_wins.take(index), table_losses.take(index)
+        else:
+            plies = np.broadcast_to(np.clip(np.asarray(ply, dtype=np.int64), 0, MAX_PLY), cp.shape)
+            wins = np.empty(cp.shape, dtype=np.int64)
+            losses = np.empty(cp.shape, dtype=np.int64)
+            for table_ply in np.unique(plies):
+                selected = plies == table_ply
+                table_wins, table_losses = self.ply_arrays(int(table_ply))
+                wins[selected] = table_wins.take(index[selected])
+                losses[selected] = table_losses.take(index[selected])
+        # Mates are rare, so they are scored one at a time
+        mates = np.abs(cp) >= MATE_THRESHOLD
+        if mates.any():
+            plies = np.broadcast_to(ply, cp.shape)
+            for position in zip(*np.nonzero(mates)):
+                wdl = self.mate_wdl(cp_score(int(cp[position])), int(plies[position]))
+                wins[position], losses[position] = wdl.wins, wdl.losses
+        return wins, 1000 - wins - losses, losses
+
+    # NumPy copies of the table of a ply
+    def ply_arrays(self, ply):
+        ply = min(max(ply, 0), MAX_PLY)
+        arrays = self.arrays.get(ply)
+        if arrays is None:
+            wins, losses = self.table(ply)
+            arrays = self.arrays[ply] = (np.array(wins, dtype=np.int64), np.array(losses, dtype=np.int64))
+        return arrays
+
+
+class PythonChessModel(WdlModel):
+    """One of the models of Cp.wdl() and Mate.wdl() in python-chess."""
+
+    def compute_wdl(self, cp, ply):
+        return Cp(cp).wdl(model=self.name, ply=ply)
+
+    def mate_wdl(self, score, ply):
+        return score.wdl(model=self.name, ply=ply)
+
+
+class CalibratedModel(WdlModel):
+    """wins = 1000 / (1 + exp((a - cp) / b)), and losses the same for -cp, with a and b fitted to games.
+
+    a is the eval at which a win is as likely as not, so a larger a means more
+    draws; b is how quickly the win rate grows with the eval."""
+
+    def __init__(self, name, a, b, **details):
+        super().__init__(name)
+        self.a = a
+        self.b = b
+        # Where the parameters come from, e.g. the Elo band and the number of positions
+        self.details = details
+
+    def wins(self, cp):
+        exponent = (self.a - min(max(cp, -CP_LIMIT), CP_LIMIT)) / self.b
+        # Far beyond the curve exp() would overflow, and the game is lost anyway
+        if exponent > 700:
+            return 0
+        return int(math.floor(0.5 + 1000 / (1 + math.exp(exponent))))
+
+    def compute_wdl(self, cp, ply):
+        wins, losses = self.wins(cp), self.wins(-cp)
+        return Wdl(wins, 1000 - wins - losses, losses)
+
+    def mate_wdl(self, score, ply):
+        # A forced mate is a sure win or loss, as in the Stockfish models
+        return score.wdl()
+
+    # Two calibrated files can carry the same default name, so the parameters are part of the key
+    def key(self):
+        return f"{self.name}(a={self.a}, b={self.b})"
+
+    def to_dict(self):
+        return {'name': self.name, 'a': self.a, 'b': self.b, **self.details}
+
+    def save(self, path):
+        with open(path, 'w') as model_file:
+            json.dump(self.to_dict(), model_file, indent=4)
+
+
+# The python-chess models by name
+MODELS = {name: PythonChessModel(name) for name in ('sf', 'sf16.1', 'sf16', 'sf15.1', 'sf15', 'sf14', 'sf12', 'lichess')}
+
+# Calibrated models loaded from JSON files, by path
+loaded_models = {}
+
+
+# Function to read a CalibratedModel saved by CalibratedModel.save()
+def load_model(path):
+    with open(path) as model_file:
+        parameters = json.load(model_file)
+    name = parameters.pop('name', os.path.splitext(os.path.basename(path))[0])
+    return CalibratedModel(name, parameters.pop('a'), parameters.pop('b'), **parameters)
+
+
+# Function to get a model from its name, the path of a calibrated model, or a model; None gives the default
+def get_model(model=None):
+    if model is None:
+        model = DEFAULT_MODEL
+    if isinstance(model, WdlModel):
+        return model
+    if model in MODELS:
+        return MODELS[model]
+    if model.endswith('.json'):
+        if model not in loaded_models:
+            loaded_models[model] = load_model(model)
+        return loaded_models[model]
+    raise ValueError(f"Unknown WDL model {model!r}, expected one of {', '.join(MODELS)} or a .json file of a calibrated model")
+
+
+# Function to collect (centipawns for the side to move, points of the side to move) for every position with an eval
+def eval_samples(paths, min_elo=None, max_elo=None):
+    for path in paths:
+        with open(path) as pgn:
+            for headers, evals in pgn_stream.read_eval_games(pgn):
+                white_points = {'1-0': 1.0, '0-1': 0.0, '1/2-1/2': 0.5}.get(headers.get('Result'))
+                if white_points is None or not in_elo_band(headers, min_elo, max_elo):
+                    continue
+                white_to_move = pgn_stream.white_starts(headers)
+                for value in evals:
+                    # Mates and evals of 10 pawns or more are left out: they say nothing about the curve
+                    if value is not None and abs(value) < 10:
+                        yield int(100 * value), white_points if white_to_move else 1 - white_points
+                    white_to_move = not white_to_move
+
+
+# Function to tell whether both players of a game are rated in min_elo <= Elo < max_elo
+def in_elo_band(headers, min_elo=None, max_elo=None):
+    if min_elo is None and max_elo is None:
+        return True
+    for name in ('WhiteElo', 'BlackElo'):
+        value = headers.get(name, '')
+        if not value.isdigit():
+            return False
+        if (min_elo is not None and int(value) < min_elo) or (max_elo is not None and int(value) >= max_elo):
+            return False
+    return True
+
+
+# Function to get the log-likelihood of binned results {cp: [wins, draws, losses]} under a and b
+def log_likelihood(bins, a, b):
+    total = 0.0
+    for cp, outcomes in bins.items():
+        wins = 1 / (1 + math.exp((a - cp) / b))
+        losses = 1 / (1 + math.exp((a + cp) / b))
+        probabilities = (wins, 1 - wins - losses, losses)
+        total += sum(count * math.log(max(probability, 1e-12)) for count, probability in zip(outcomes, probabilities) if count)
+    return total
+
+
+# Function to fit a CalibratedModel to (centipawns, points) samples by maximum likelihood
+def calibrate(samples, name='calibrated', bin_width=10, **details):
+    # Positions are binned by eval, so the fit costs the same for any number of games
+    bins = {}
+    positions = 0
+    for cp, points in samples:
+        cp = max(-CP_LIMIT, min(CP_LIMIT, cp))
+        outcomes = bins.setdefault(bin_width * round(cp / bin_width), [0, 0, 0])
+        outcomes[0 if points == 1 else 1 if points == 0.5 else 2] += 1
+        positions += 1
+    if not positions:
+        raise ValueError("No positions with an eval and a result to calibrate on")
+    # Coordinate search from about the sf16.1 curve at move 15, halving the step until it is small;
+    # both parameters stay within the table, where they still mean something
+    a, b = 100.0, 25.0
+    best = log_likelihood(bins, a, b)
+    step = 64.0
+    while step >= 0.25:
+        improved = False
+        for da, db in ((step, 0), (-step, 0), (0, step), (0, -step)):
+            if not (0 < a + da <= CP_LIMIT and 0 < b + db <= CP_LIMIT):
+                continue
+            likelihood = log_likelihood(bins, a + da, b + db)
+            if likelihood > best:
+                a, b, best = a + da, b + db, likelihood
+                improved = True
+        if not improved:
+            step /= 2
+    return CalibratedModel(name, round(a, 2), round(b, 2), positions=positions, **details)
+
+
+# Function to fit a model to the eval-annotated games of an Elo band
+def calibrate_from_pgn(paths, min_elo=None, max_elo=None, name=None):
+    if name is None:
+        name = f"elo{min_elo or 0}-{max_elo or ''}"
+    return calibrate(eval_samples(paths, min_elo, max_elo), name, min_elo=min_elo, max_elo=max_elo)
+
+
+# Main function
+def main(pgn_files=('PGN_file_goes_here.pgn',), output_file='calibrated_model.json', min_elo=None, max_elo=None, name=None):
+    model = calibrate_from_pgn(pgn_files, min_elo, max_elo, name)
+    model.save(output_file)
+    print(f"{model.name}: a = {model.a}, b = {model.b} from {model.details['positions']} positions, saved to {output_file}")
+    return model
+
+
+# Call the main function
+if __name__ == "__main__":
+    main()